@@ -0,0 +1,297 @@
+# benchmark.py
+#
+# Headless render benchmark. Builds a Game under the SDL dummy video driver
+# with a fixed seed, drives every screen for a number of frames and reports
+# frames/sec and per-frame percentiles. With --golden it also compares the
+# frame each scene shows after its warm-up against stored PNGs, pixel for pixel.
+#
+#   python benchmark.py                       # timings only
+#   python benchmark.py --update-golden       # write golden frames
+#   python benchmark.py --golden              # compare against them
+#
+# Text is rendered with whatever font SysFont resolves on the host, so golden
+# frames are only comparable on the machine (or image) that wrote them.
+
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import argparse
+import random
+import sys
+import time
+import pygame
+from config import *
+from main import ATTACK_BAR, INDICATOR_WIDTH, Enemy, Game
+
+DEFAULT_GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+WARMUP_FRAMES = 16  # Untimed frames per scene; the golden frame is taken after them
+
+
+def find_cell(game, town):
+    # First world cell with or without a town whose terrain is mostly walkable,
+    # scanning outward from the current cell
+    start_x, start_y = game.current_cell
+    radius = WORLD_CHUNK_CELLS * WORLD_CHUNK_RADIUS
+    cells = [(x, y) for y in range(start_y - radius, start_y + radius + 1) for x in range(start_x - radius, start_x + radius + 1)]
+    cells.sort(key=lambda cell: abs(cell[0] - start_x) + abs(cell[1] - start_y))
+    for x, y in cells:
+        cell_data = game.world_map.cell(x, y)
+        if TILE_WALKABLE[TILE_IDS[cell_data['biome']]] and cell_data['town'] == town:
+            return (x, y)
+    return (start_x, start_y)
+
+
+def enter_cell(game, cell):
+    game.state = 'world_map'
+    game.selected_cell = cell
+    game.handle_world_map_events(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_RETURN, unicode='\r'))
+
+
+def walk_path(game, length=8):
+    # Walkable positions near the middle of the map to step back and forth
+    # along, so the camera scrolls and the incremental redraw paths are exercised
+    width, height = game.local_map.width, game.local_map.height
+    walkable = [(x, y) for y in range(height) for x in range(width) if game.local_map.walkable(x, y)]
+    path = [min(walkable, key=lambda pos: abs(pos[0] - width // 2) + abs(pos[1] - height // 2))]
+    for _ in range(length):
+        x, y = path[-1]
+        for dx, dy in ((1, 0), (0, 1), (-1, 0), (0, -1)):
+            nx, ny = x + dx, y + dy
+            if (nx, ny) not in path and game.local_map.walkable(nx, ny):
+                path.append((nx, ny))
+                break
+        else:
+            break
+    return path + path[-2:0:-1]
+
+
+def local_map_scene(game, setup):
+    setup(game)
+    path = walk_path(game)
+
+    def frame(i):
+        game.player_x, game.player_y = path[i % len(path)]
+        game.draw()
+    return frame
+
+
+def scene_main_menu(game):
+    game.state = 'main_menu'
+
+    def frame(i):
+        game.damage.invalidate()
+        game.draw()
+    return frame
+
+
+def scene_world_map(game):
+    game.state = 'world_map'
+    keys = [pygame.K_d, pygame.K_d, pygame.K_s, pygame.K_s, pygame.K_a, pygame.K_a, pygame.K_w, pygame.K_w]
+
+    def frame(i):
+        game.handle_world_map_events(pygame.event.Event(pygame.KEYDOWN, key=keys[i % len(keys)], unicode=''))
+        game.draw()
+    return frame
+
+
+def scene_wilderness(game):
+    return local_map_scene(game, lambda game: enter_cell(game, find_cell(game, town=False)))
+
+
+def scene_town(game):
+    return local_map_scene(game, lambda game: enter_cell(game, find_cell(game, town=True)))
+
+
+def scene_dungeon(game):
+    def setup(game):
+        enter_cell(game, find_cell(game, town=False))
+        game.enter_dungeon()
+    return local_map_scene(game, setup)
+
+
+def scene_travel(game):
+    # Travel back and forth between two tiles, typed as a command. The map is
+    # redrawn every TRAVEL_DRAW_INTERVAL steps on the way; a redraw identical
+    # to the one before it means the trip was not shown.
+    enter_cell(game, find_cell(game, town=False))
+    game.enemies.clear()
+    start = (game.player_x, game.player_y)
+    targets = [(x, y) for y in range(game.local_map.height) for x in range(game.local_map.width)
+               if abs(x - start[0]) + abs(y - start[1]) == 3 * TRAVEL_DRAW_INTERVAL]
+    target = next(position for position in targets if game.local_map.walkable(*position)
+                  and game.travel_planner.tile_path(game.local_map, game.current_cell, start, position))
+    draw = game.draw
+
+    def frame(i):
+        redraws = []
+
+        def traced_draw():
+            draw()
+            redraws.append(pygame.image.tobytes(game.screen, 'RGB'))
+        game.draw = traced_draw
+        game.command_mode = True
+        game.command_input = 'travel %d %d' % (target if i % 2 == 0 else start)
+        game.handle_command_input(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_RETURN, unicode='\r'))
+        game.draw = draw
+        if not redraws or any(earlier == later for earlier, later in zip(redraws, redraws[1:])):
+            raise RuntimeError('travel was not redrawn as it went')
+        game.draw()
+    return frame
+
+
+def scene_command_overlay(game):
+    enter_cell(game, find_cell(game, town=False))
+    game.draw()
+    game.command_mode = True
+    game.command_input = ''
+    text = 'regioninfo'
+
+    def frame(i):
+        # Type the command, then erase it again
+        step = i % (2 * len(text))
+        length = step if step <= len(text) else 2 * len(text) - step
+        game.command_input = text[:length]
+        game.draw()
+    return frame
+
+
+def combat_setup(game):
+    enter_cell(game, find_cell(game, town=False))
+    enemy = game.enemies[0] if game.enemies else None
+    if enemy is None:
+        enemy = Enemy(game.player_x, game.player_y, 'Goblin')
+    game.current_enemy = enemy
+
+
+def scene_attack_phase(game):
+    combat_setup(game)
+    travel = ATTACK_BAR.width - INDICATOR_WIDTH
+
+    def frame(i):
+        # Sweep 5 pixels per frame, bouncing at both ends
+        step = (i * 5) % (2 * travel)
+        offset = step if step <= travel else 2 * travel - step
+        if i == 0:
+            game.draw_attack_phase(ATTACK_BAR.x + offset)
+            pygame.display.flip()
+        else:
+            pygame.display.update(game.draw_attack_indicator(ATTACK_BAR.x + offset))
+    return frame
+
+
+def scene_defense_phase(game):
+    combat_setup(game)
+    arrow_keys = [pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT]
+    arrows = [random.choice(arrow_keys) for _ in range(5)]
+
+    def frame(i):
+        # Draw the sequence, then dim one arrow per frame as defense_phase does
+        passed = i % (len(arrows) + 1)
+        if passed == 0:
+            game.draw_defense_phase(arrows, 0)
+            pygame.display.flip()
+        else:
+            pygame.display.update(game.draw_defense_arrow(arrows, passed - 1, True))
+    return frame
+
+
+SCENES = [
+    ('main_menu', scene_main_menu),
+    ('world_map', scene_world_map),
+    ('wilderness', scene_wilderness),
+    ('town', scene_town),
+    ('dungeon', scene_dungeon),
+    ('travel', scene_travel),
+    ('command_overlay', scene_command_overlay),
+    ('attack_phase', scene_attack_phase),
+    ('defense_phase', scene_defense_phase),
+]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def compare_golden(surface, path):
+    # Returns the number of differing pixels, or None if there is no golden frame
+    if not os.path.exists(path):
+        return None
+    golden = pygame.image.load(path)
+    if golden.get_size() != surface.get_size():
+        return surface.get_width() * surface.get_height()
+    actual = pygame.image.tobytes(surface, 'RGB')
+    expected = pygame.image.tobytes(golden, 'RGB')
+    if actual == expected:
+        return 0
+    return sum(1 for i in range(0, len(actual), 3) if actual[i:i + 3] != expected[i:i + 3])
+
+
+def run(args):
+    results = []
+    failures = 0
+    for name, scene in SCENES:
+        if args.scenes and name not in args.scenes:
+            continue
+        # Every scene starts from the same seeded game so frames are reproducible
+        random.seed(args.seed)
+        game = Game()
+        game.autosave_file = None  # Keep the benchmark from writing autosave files
+        frame = scene(game)
+        game.damage.invalidate()
+
+        for i in range(WARMUP_FRAMES):
+            frame(i)
+
+        status = ''
+        path = os.path.join(args.golden_dir, f'{name}.png')
+        if args.update_golden:
+            os.makedirs(args.golden_dir, exist_ok=True)
+            pygame.image.save(game.screen, path)
+            status = 'golden written'
+        elif args.golden:
+            differing = compare_golden(game.screen, path)
+            if differing is None:
+                status = 'no golden'
+                failures += 1
+            elif differing:
+                status = f'MISMATCH ({differing} px)'
+                failures += 1
+            else:
+                status = 'golden ok'
+
+        timings = []
+        for i in range(WARMUP_FRAMES, WARMUP_FRAMES + args.frames):
+            if args.full_redraw:
+                game.damage.invalidate()
+            start = time.perf_counter()
+            frame(i)
+            timings.append(time.perf_counter() - start)
+
+        total = sum(timings)
+        fps = len(timings) / total if total else float('inf')
+        results.append((name, fps, [t * 1000 for t in timings], status))
+
+    print(f'{"scene":<16} {"fps":>9} {"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    for name, fps, timings, status in results:
+        print(f'{name:<16} {fps:9.1f} {percentile(timings, 0.5):8.3f} {percentile(timings, 0.9):8.3f} '
+              f'{percentile(timings, 0.99):8.3f} {max(timings):8.3f}  {status}')
+    pygame.quit()
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless render benchmark for Valdmir.')
+    parser.add_argument('--frames', type=int, default=300, help='timed frames per scene')
+    parser.add_argument('--seed', type=int, default=1234, help='random seed for world generation')
+    parser.add_argument('--full-redraw', action='store_true', help='force a full redraw every frame')
+    parser.add_argument('--golden', action='store_true', help='compare final frames against golden PNGs')
+    parser.add_argument('--update-golden', action='store_true', help='write final frames as golden PNGs')
+    parser.add_argument('--golden-dir', default=DEFAULT_GOLDEN_DIR, help='directory holding golden PNGs')
+    parser.add_argument('scenes', nargs='*', help=f'scenes to run (default: all of {", ".join(name for name, _ in SCENES)})')
+    sys.exit(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
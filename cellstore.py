@@ -0,0 +1,86 @@
+# cellstore.py
+
+import os
+import pickle
+import tempfile
+import zlib
+from collections import OrderedDict
+from config import *
+
+
+class CellStore:
+    # The saved state of visited cells or dungeon levels, used like a dict.
+    # Only the most recently used entries stay in memory; older ones are
+    # pickled, zlib-compressed and appended to a spill file until they are
+    # needed again. Space left behind by entries read back is reclaimed by
+    # rewriting the file once it is mostly unused.
+    def __init__(self, size=CELL_CACHE_SIZE, spill_dir=CELL_SPILL_DIR):
+        self.size = size
+        self.cells = OrderedDict()  # Kept in least-recently-used order
+        self.spilled = {}  # Key: cell key, Value: (offset, length) in the spill file
+        self.spill_garbage = 0  # Bytes of the spill file no longer in use
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+        # An unnamed file, removed by the system when it is closed
+        self.spill_file = tempfile.TemporaryFile(prefix='valdmir-cells-', dir=spill_dir)
+
+    def __contains__(self, key):
+        return key in self.cells or key in self.spilled
+
+    def __len__(self):
+        return len(self.cells) + len(self.spilled)
+
+    def __getitem__(self, key):
+        if key in self.cells:
+            self.cells.move_to_end(key)
+            return self.cells[key]
+        location = self.spilled.pop(key)  # KeyError for unknown keys, as with a dict
+        cell_state = pickle.loads(zlib.decompress(self.read_spilled(location)))
+        self.spill_garbage += location[1]
+        self.cells[key] = cell_state
+        self.evict()
+        return cell_state
+
+    def __setitem__(self, key, cell_state):
+        self.discard_spilled(key)
+        self.cells[key] = cell_state
+        self.cells.move_to_end(key)
+        self.evict()
+
+    def items(self):
+        # Every (key, state) pair from least to most recently used, reading
+        # spilled entries without caching them
+        for key, location in sorted(self.spilled.items(), key=lambda item: item[1]):
+            yield key, pickle.loads(zlib.decompress(self.read_spilled(location)))
+        for key, cell_state in list(self.cells.items()):
+            yield key, cell_state
+
+    def read_spilled(self, location):
+        offset, length = location
+        self.spill_file.seek(offset)
+        return self.spill_file.read(length)
+
+    def discard_spilled(self, key):
+        location = self.spilled.pop(key, None)
+        if location is not None:
+            self.spill_garbage += location[1]
+
+    def evict(self):
+        while len(self.cells) > self.size:
+            key, cell_state = self.cells.popitem(last=False)
+            data = zlib.compress(pickle.dumps(cell_state, pickle.HIGHEST_PROTOCOL), 1)  # Fastest level; entries are small
+            offset = self.spill_file.seek(0, os.SEEK_END)
+            self.spill_file.write(data)
+            self.spilled[key] = (offset, len(data))
+        if self.spill_garbage > 1 << 20 and self.spill_garbage * 2 > self.spill_file.seek(0, os.SEEK_END):
+            self.compact()
+
+    def compact(self):
+        # Rewrite the spill file with only the entries still spilled
+        entries = [(key, self.read_spilled(location)) for key, location in self.spilled.items()]
+        self.spill_file.seek(0)
+        self.spill_file.truncate()
+        for key, data in entries:
+            self.spilled[key] = (self.spill_file.tell(), len(data))
+            self.spill_file.write(data)
+        self.spill_garbage = 0
@@ -1,11 +1,12 @@
 # config.py
 
 import pygame
+from collections import OrderedDict
 
 # Game Settings
 WINDOW_WIDTH = 1280  # Increased from 800
 WINDOW_HEIGHT = 720  # Increased from 600
-FPS = 60  # Frames per second
+FPS = 60  # Frame rate cap while input is arriving
 
 # Time Settings
 TIME_INCREMENT = 10  # Minutes per turn
@@ -31,6 +32,7 @@ GRAY = (169, 169, 169)
 # Fonts
 FONT_SIZE = 16
 FONT_NAME = 'couriernew'  # Use a monospaced font
+TEXT_CACHE_SIZE = 512  # Rendered text surfaces kept by the text cache
 
 # Grid settings
 TILE_SIZE = 16
@@ -38,11 +40,28 @@ LOCAL_MAP_WIDTH = 100  # Width of local map (in tiles)
 LOCAL_MAP_HEIGHT = 100  # Height of local map (in tiles)
 VIEWPORT_WIDTH = (WINDOW_WIDTH - 200) // TILE_SIZE  # Visible tiles in viewport
 VIEWPORT_HEIGHT = WINDOW_HEIGHT // TILE_SIZE
-
-# World Map settings (Increased size)
-WORLD_MAP_WIDTH = 40  # Increased from 20
-WORLD_MAP_HEIGHT = 30  # Increased from 15
+TERRAIN_CACHE_SIZE = 4  # Pre-rendered terrain layers kept in memory
+FOV_RADIUS = 10  # Tiles the player can see in every direction
+FOG_SEEN_COLOR = (90, 90, 110)  # Multiplied into explored tiles that are out of view
+ENTITY_BUCKET_SIZE = 16  # Tiles per side of the squares entities are bucketed in for range queries
+
+# World Map settings. The world has no edges; it is generated in chunks
+WORLD_CHUNK_CELLS = 16  # World cells per side of each generated chunk
+WORLD_CHUNK_RADIUS = 3  # Chunks kept loaded in each direction around the player
 CELL_SIZE = 32  # Size of each cell on the world map display
+WORLD_PAGE_CELLS = 16  # World map cells per side of each pre-rendered page
+WORLD_PAGE_CACHE_SIZE = 24  # Pre-rendered world map pages kept in memory
+CELL_CACHE_SIZE = 64  # Visited cells and dungeon levels whose state is kept in memory
+PREFETCH_DISTANCE = 12  # Tiles from a local map edge at which the next cell starts generating
+DUNGEON_PREFETCH_DISTANCE = 8  # Tiles from a dungeon entrance at which all of its levels start generating
+CELL_SPILL_DIR = None  # Where evicted cell state is written; None for a per-session temp directory
+TRAVEL_BIOME_COSTS = {'PLAIN': 1, 'DESERT': 1, 'FOREST': 3, 'MOUNTAIN': 3}  # Route cost of crossing a world cell; other biomes are avoided
+TRAVEL_MAX_CELLS = 4096  # World cells the travel planner searches before giving up
+TRAVEL_PATH_CACHE_SIZE = 128  # Paths across local maps kept by the travel planner
+TRAVEL_DRAW_INTERVAL = 10  # Turns between redraws while travelling
+SAVE_FILE = 'valdmir.sav'  # Written by the save command, read by load
+AUTOSAVE_FILE = 'valdmir.autosave'  # Autosave snapshot; its journal is written next to it. None turns autosave off
+AUTOSAVE_SNAPSHOT_RECORDS = 1000  # Journal records after which autosave writes a new snapshot
 
 # Biome and terrain tiles
 TILES = {
@@ -64,6 +83,26 @@ TILES = {
     'BUILDING_ENTRANCE': {'char': '+', 'color': BROWN, 'walkable': True, 'name': 'Building Entrance'},
 }
 
+# Precompiled tile tables. Maps store each tile as its ID, the index of its
+# type in TILES, so these lookups replace TILES[tile_type][...] on hot paths.
+TILE_TYPES = list(TILES)
+TILE_IDS = {tile_type: tile_id for tile_id, tile_type in enumerate(TILE_TYPES)}
+TILE_WALKABLE = bytes(TILES[tile_type]['walkable'] for tile_type in TILE_TYPES)
+TILE_CHARS = [TILES[tile_type]['char'] for tile_type in TILE_TYPES]
+TILE_COLORS = [TILES[tile_type]['color'] for tile_type in TILE_TYPES]
+TILE_NAMES = [TILES[tile_type]['name'] for tile_type in TILE_TYPES]
+
+# Tiles of interest, such as doors and stairs, that entities are never placed on
+FEATURE_TILES = ['DOOR', 'DUNGEON_ENTRANCE', 'STAIRS_DOWN', 'CHEST', 'STAIRS_UP', 'ENTRANCE', 'BUILDING_ENTRANCE']
+TILE_FEATURE = bytes(tile_type in FEATURE_TILES for tile_type in TILE_TYPES)
+# 1 for walkable tiles that are not features: where entities can be placed. A
+# 256-byte table, so bytes.translate() can map a whole map through it.
+TILE_OPEN = bytes(TILE_WALKABLE[tile_id] and not TILE_FEATURE[tile_id] for tile_id in range(len(TILE_TYPES))).ljust(256, b'\0')
+
+# Tiles that block sight
+OPAQUE_TILES = ['MOUNTAIN', 'HOUSE_WALL', 'WALL']
+TILE_OPAQUE = bytes(tile_type in OPAQUE_TILES for tile_type in TILE_TYPES)
+
 BIOMES = ['PLAIN', 'FOREST', 'MOUNTAIN', 'DESERT', 'WATER']
 BIOME_COLORS = {
     'PLAIN': (34, 139, 34),
@@ -74,6 +113,16 @@ BIOME_COLORS = {
     'TOWN': YELLOW,  # Color for towns on the world map
 }
 
+# Local map terrain per biome: (cumulative probability, tile type) thresholds.
+# A tile is the first type whose threshold is above a random() draw.
+BIOME_TILE_THRESHOLDS = {
+    'PLAIN': [(0.05, 'FOREST'), (0.06, 'MOUNTAIN'), (1.0, 'PLAIN')],  # Mostly plains, with small features
+    'FOREST': [(0.7, 'FOREST'), (1.0, 'PLAIN')],
+    'MOUNTAIN': [(0.7, 'MOUNTAIN'), (1.0, 'PLAIN')],
+    'DESERT': [(0.1, 'MOUNTAIN'), (1.0, 'DESERT')],
+    'WATER': [(0.9, 'WATER'), (1.0, 'PLAIN')],
+}
+
 # Enemy Stats
 ENEMY_STATS = {
     'Goblin': {
@@ -114,6 +163,11 @@ ENEMY_STATS = {
     },
 }
 
+ENEMY_AGGRO_RADIUS = 10  # Walking distance within which aggressive enemies pursue the player
+CATCH_UP_DESPAWN_CHANCE = 0.002  # Chance per turn away that an enemy has left a cell when the player returns
+CATCH_UP_RESPAWN_CHANCE = 0.005  # Chance per turn away that new enemies have arrived in a cell
+CELL_ENEMY_LIMIT = 6  # Most enemies that arrivals can bring a cell up to
+
 # Villager Stats
 VILLAGER_STATS = {
     'char': '@',
@@ -148,8 +202,41 @@ class Rect:
         return (self.x1 <= other.x2 and self.x2 >= other.x1 and
                 self.y1 <= other.y2 and self.y2 >= other.y1)
     
+# Font registry: SysFont lookups are slow, so each (name, size) is resolved once
+font_registry = {}
+
+def get_font(font_size=FONT_SIZE, font_name=FONT_NAME):
+    font = font_registry.get((font_name, font_size))
+    if font is None:
+        font = pygame.font.SysFont(font_name, font_size)
+        font_registry[(font_name, font_size)] = font
+    return font
+
+class TextCache:
+    # Size-bounded LRU of rendered text surfaces. Cached surfaces are shared,
+    # so callers must copy one before modifying it.
+    def __init__(self, size=TEXT_CACHE_SIZE):
+        self.size = size
+        self.surfaces = OrderedDict()
+
+    def render(self, text, color=WHITE, font_size=FONT_SIZE, font_name=FONT_NAME):
+        key = (text, font_size, color, font_name)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = get_font(font_size, font_name).render(text, True, color)
+            self.surfaces[key] = surface
+            if len(self.surfaces) > self.size:
+                self.surfaces.popitem(last=False)
+        else:
+            self.surfaces.move_to_end(key)
+        return surface
+
+text_cache = TextCache()
+
+def render_text(text, color=WHITE, font_size=FONT_SIZE, font_name=FONT_NAME):
+    return text_cache.render(text, color, font_size, font_name)
+
 # Helper function for drawing text
 def draw_text(surface, text, x, y, color=WHITE, font_size=FONT_SIZE, font_name=FONT_NAME):
-    font = pygame.font.SysFont(font_name, font_size)
-    text_surface = font.render(text, True, color)
-    surface.blit(text_surface, (x, y))
\ No newline at end of file
+    text_surface = render_text(text, color, font_size, font_name)
+    surface.blit(text_surface, (x, y))
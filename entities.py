@@ -0,0 +1,129 @@
+# entities.py
+
+import random
+from config import *
+
+
+class Enemy:
+    def __init__(self, x, y, enemy_type, rng=random, attack=None, gold=None):
+        # attack and gold are rolled unless given, e.g. when restoring a saved enemy
+        self.x = x
+        self.y = y
+        stats = ENEMY_STATS[enemy_type]
+        self.char = stats['char']
+        self.color = stats['color']
+        self.name = enemy_type
+        self.attack = rng.randint(*stats['attack']) if attack is None else attack
+        self.health = stats['health']
+        self.max_health = stats['health']
+        self.xp = stats['xp']
+        self.gold = rng.randint(*stats['gold']) if gold is None else gold
+        self.behavior = stats['behavior']
+
+    def move(self, player_x, player_y, local_map, time_of_day, grid, flow_field, fov):
+        # Steps onto tiles held by other entities are refused; the player's tile is not in the grid.
+        # flow_field is the map's distances to the player this turn, see TileMap.distances_from(),
+        # and fov the player's field of view: an enemy sees the player when the player sees it.
+        if self.behavior == 'aggressive':
+            # Pursue when the player is in sight and within walking range, one
+            # step downhill on the flow field; of equal steps, the one closing
+            # the larger gap
+            distance = flow_field.get((self.x, self.y))
+            if distance and fov.can_see(self.x, self.y):
+                best = None
+                for new_x, new_y in ((self.x + 1, self.y), (self.x - 1, self.y), (self.x, self.y + 1), (self.x, self.y - 1)):
+                    if flow_field.get((new_x, new_y)) == distance - 1 and grid.at(new_x, new_y) is None:
+                        gap = max(abs(player_x - new_x), abs(player_y - new_y))
+                        if best is None or gap < best[0]:
+                            best = (gap, new_x, new_y)
+                if best is not None:
+                    grid.move(self, best[1], best[2])
+        elif self.behavior == 'random':
+            # Move randomly
+            dx = random.choice([-1, 0, 1])
+            dy = random.choice([-1, 0, 1])
+            new_x = self.x + dx
+            new_y = self.y + dy
+            if local_map.walkable(new_x, new_y) and grid.at(new_x, new_y) is None:
+                grid.move(self, new_x, new_y)
+
+
+class Villager:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+        self.char = VILLAGER_STATS['char']
+        self.color = VILLAGER_STATS['color']
+        self.name = 'Villager'
+
+    def move(self, local_map, grid):
+        # Simple random walk within town area
+        dx = random.choice([-1, 0, 1])
+        dy = random.choice([-1, 0, 1])
+        new_x = self.x + dx
+        new_y = self.y + dy
+        if local_map.walkable(new_x, new_y) and grid.at(new_x, new_y) is None:
+            grid.move(self, new_x, new_y)
+
+
+class EntityGrid:
+    # Where the enemies and villagers of one map are. Each tile holds at most
+    # one entity for lookups and collisions, and entities are also bucketed
+    # into ENTITY_BUCKET_SIZE squares, so a range query (the viewport, or a
+    # radius around a point) only visits the buckets it overlaps. Entities
+    # must be moved and removed through the grid to keep it current.
+    def __init__(self, enemies, villagers):
+        self.enemies = enemies
+        self.villagers = villagers
+        self.occupants = {}  # Key: (x, y), Value: entity
+        self.buckets = {}  # Key: (x, y) // ENTITY_BUCKET_SIZE, Value: dict of entities, as an insertion-ordered set
+        for entity in enemies + villagers:
+            self.add(entity)
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    def at(self, x, y):
+        return self.occupants.get((x, y))
+
+    def add(self, entity):
+        # Spawning never stacks entities, but a damaged or hand-edited save
+        # can; a second entity on a tile is still kept and drawn, though only
+        # the first one is found by at()
+        self.occupants.setdefault((entity.x, entity.y), entity)
+        bucket_key = (entity.x // ENTITY_BUCKET_SIZE, entity.y // ENTITY_BUCKET_SIZE)
+        self.buckets.setdefault(bucket_key, {})[entity] = None
+
+    def remove(self, entity):
+        position = (entity.x, entity.y)
+        bucket_key = (entity.x // ENTITY_BUCKET_SIZE, entity.y // ENTITY_BUCKET_SIZE)
+        bucket = self.buckets[bucket_key]
+        del bucket[entity]
+        if self.occupants.get(position) is entity:
+            del self.occupants[position]
+            # Another entity on the same tile takes its place
+            for other in bucket:
+                if (other.x, other.y) == position:
+                    self.occupants[position] = other
+                    break
+        if not bucket:
+            del self.buckets[bucket_key]
+
+    def move(self, entity, x, y):
+        self.remove(entity)
+        entity.x, entity.y = x, y
+        self.add(entity)
+
+    def in_rect(self, x, y, width, height):
+        # The entities with x <= entity.x < x + width and y <= entity.y < y + height
+        found = []
+        for bucket_y in range(y // ENTITY_BUCKET_SIZE, (y + height - 1) // ENTITY_BUCKET_SIZE + 1):
+            for bucket_x in range(x // ENTITY_BUCKET_SIZE, (x + width - 1) // ENTITY_BUCKET_SIZE + 1):
+                for entity in self.buckets.get((bucket_x, bucket_y), ()):
+                    if x <= entity.x < x + width and y <= entity.y < y + height:
+                        found.append(entity)
+        return found
+
+    def near(self, x, y, radius):
+        # The entities within radius tiles of (x, y) in both directions
+        return self.in_rect(x - radius, y - radius, 2 * radius + 1, 2 * radius + 1)
@@ -0,0 +1,95 @@
+# fov.py
+#
+# What the player can see. The field of view is found by recursive
+# shadowcasting: each of the eight octants around the player is scanned row
+# by row outward, and every opaque tile met narrows the range of slopes still
+# lit for the rows behind it, so each tile within the radius is visited at
+# most once. It is recomputed only when the player moves, the map changes or
+# a tile is changed; everything else reuses the last result. Tiles that
+# come into view are marked in the map's explored bitset (TileMap.explored).
+
+import pygame
+from config import *
+
+# Octant transforms (xx, xy, yx, yy) from scan coordinates to map offsets
+OCTANTS = ((1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+           (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1))
+
+
+class FieldOfView:
+    def __init__(self, radius=FOV_RADIUS):
+        self.radius = radius
+        self.tile_map = None
+        self.origin = None
+        self.visible = set()  # Indices of the tiles in view
+        self.box = None  # pygame.Rect of tiles bounding everything in view
+        self.revision = 0  # Counts recomputations, so callers can tell the view changed
+        # The scan of each octant, precomputed: per row outward, the tiles in
+        # scan order as (left slope, right slope, x offset, y offset, within radius)
+        self.octants = []
+        for xx, xy, yx, yy in OCTANTS:
+            rows = [None]
+            for distance in range(1, radius + 1):
+                dy = -distance
+                rows.append([((dx - 0.5) / (dy + 0.5), (dx + 0.5) / (dy - 0.5), dx * xx + dy * xy, dx * yx + dy * yy,
+                              dx * dx + dy * dy <= radius * radius) for dx in range(-distance, 1)])
+            self.octants.append(rows)
+
+    def invalidate(self):
+        # A tile changed; the next update() recomputes
+        self.origin = None
+
+    def update(self, tile_map, x, y):
+        # Recompute the view from (x, y) if the player or the map changed, and
+        # mark what comes into view as explored in the map's bitset
+        if tile_map is self.tile_map and (x, y) == self.origin:
+            return
+        previous = self.visible if tile_map is self.tile_map else set()
+        self.tile_map = tile_map
+        self.origin = (x, y)
+        visible = self.visible = {y * tile_map.width + x}
+        for rows in self.octants:
+            self.cast_light(tile_map, visible, x, y, rows, 1, 1.0, 0.0)
+        explored = tile_map.explored
+        for index in visible - previous:
+            explored[index >> 3] |= 1 << (index & 7)
+        self.box = pygame.Rect(x - self.radius, y - self.radius, 2 * self.radius + 1, 2 * self.radius + 1)
+        self.revision += 1
+
+    def cast_light(self, tile_map, visible, origin_x, origin_y, rows, row, start, end):
+        # Light one octant from row outward, between the slopes start and end
+        width, height, tiles = tile_map.width, tile_map.height, tile_map.tiles
+        new_start = start
+        for distance in range(row, self.radius + 1):
+            blocked = False
+            for left_slope, right_slope, offset_x, offset_y, lit in rows[distance]:
+                if start < right_slope:
+                    continue
+                if end > left_slope:
+                    break
+                map_x = origin_x + offset_x
+                map_y = origin_y + offset_y
+                if 0 <= map_x < width and 0 <= map_y < height:
+                    index = map_y * width + map_x
+                    if lit:
+                        visible.add(index)
+                    opaque = TILE_OPAQUE[tiles[index]]
+                else:
+                    opaque = True  # Nothing past the map edge is seen
+                if blocked:
+                    if opaque:
+                        new_start = right_slope
+                    else:
+                        blocked = False
+                        start = new_start
+                elif opaque and distance < self.radius:
+                    # Light the part of the next rows beside this blocker, then
+                    # carry on past it
+                    blocked = True
+                    self.cast_light(tile_map, visible, origin_x, origin_y, rows, distance + 1, start, left_slope)
+                    new_start = right_slope
+            if blocked or start < end:
+                return
+
+    def can_see(self, x, y):
+        return self.tile_map is not None and 0 <= x < self.tile_map.width and y * self.tile_map.width + x in self.visible
@@ -0,0 +1,288 @@
+# journal.py
+#
+# Autosave. Every so often the whole game is written to a snapshot, a normal
+# save file; everything that changes after it is appended to a journal next
+# to it. A journal file is a header naming the snapshot it follows, then
+# records framed as
+#
+#   payload length, CRC-32 of the payload, payload
+#
+# so a record cut short by a crash is detected and dropped on recovery. A
+# payload is a record type followed by the new value of what changed, in the
+# same encodings as the save file, so replaying a journal only assigns values
+# in order. Records are packed on the main thread, a few struct packs per turn;
+# a writer thread does all of the file I/O. Explored tiles are not journaled,
+# so recovery forgets what was explored after the last snapshot.
+
+import os
+import queue
+import struct
+import threading
+import zlib
+from config import *
+import savegame
+import worldgen
+from savegame import DUNGEON, PLACE, PLAYER, SaveReader, SaveWriter
+from tilemap import explored_bits
+
+JOURNAL_MAGIC = b'VJNL'
+JOURNAL_HEADER = struct.Struct('<4sQ')  # Magic, journal id of the snapshot it follows
+FRAME = struct.Struct('<II')  # Payload length, CRC-32 of the payload
+RECORD_TYPE = struct.Struct('<B')
+MAP_KEY = struct.Struct('<?iiiii')  # Dungeon flag, cell x, y, and for dungeon levels entrance x, y, level
+TILE = struct.Struct('<IB')  # Index, tile ID
+POSITION = struct.Struct('<ii')
+
+# Record types and what follows them
+PLAYER_RECORD = 1  # PLAYER
+PLACE_RECORD = 2  # PLACE, DUNGEON in a dungeon, local map biome
+TILE_RECORD = 3  # MAP_KEY, TILE
+ENTITIES_RECORD = 4  # MAP_KEY, player position, enemies, villagers
+INVENTORY_RECORD = 5  # Inventory, equipped items
+
+
+class AutosaveJournal:
+    def __init__(self, snapshot_path=AUTOSAVE_FILE):
+        self.snapshot_path = snapshot_path
+        self.path = snapshot_path + '.journal'
+        self.records = 0  # Records queued since the last snapshot
+        self.error = None  # Set by the writer thread if a write fails; nothing more is written
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.write_loop, name='autosave', daemon=True)
+        self.thread.start()
+
+    def write_loop(self):
+        # Snapshots arrive as (data, journal id) and start a new journal,
+        # records as framed bytes, None asks the thread to stop
+        journal_file = None
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                if isinstance(item, tuple):
+                    data, journal_id = item
+                    savegame.write_save(self.snapshot_path, data)
+                    # Until the journal is restarted it names the previous
+                    # snapshot, so a crash in between does not replay it twice
+                    if journal_file is not None:
+                        journal_file.close()
+                    journal_file = open(self.path, 'wb')
+                    journal_file.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, journal_id))
+                elif journal_file is not None:
+                    journal_file.write(item)
+                if journal_file is not None and self.queue.empty():
+                    # Handed to the system once the backlog is written; that is
+                    # enough to survive the game crashing
+                    journal_file.flush()
+        except OSError as error:
+            self.error = error
+        finally:
+            if journal_file is not None:
+                journal_file.close()
+
+    def close(self):
+        # Write out everything queued and stop the writer thread
+        self.queue.put(None)
+        self.thread.join()
+
+    def snapshot(self, game):
+        # Start over from a full save of the game
+        journal_id = int.from_bytes(os.urandom(8), 'little') or 1  # 0 is kept for saves made by hand
+        self.put((savegame.encode_game(game, journal_id), journal_id))
+        self.records = 0
+
+    def put(self, item):
+        if self.error is None:
+            self.queue.put(item)
+
+    def append(self, record_type, writer):
+        payload = RECORD_TYPE.pack(record_type) + b''.join(writer.chunks)
+        self.put(FRAME.pack(len(payload), zlib.crc32(payload)) + payload)
+        self.records += 1
+
+    def map_key(self, writer, game):
+        # The store key of the map in play
+        if game.dungeon_key is not None:
+            (cell_x, cell_y), (entrance_x, entrance_y), level = game.dungeon_key
+            writer.pack(MAP_KEY, True, cell_x, cell_y, entrance_x, entrance_y, level)
+        else:
+            writer.pack(MAP_KEY, False, *game.current_cell, 0, 0, 0)
+
+    def player(self, game):
+        writer = SaveWriter()
+        writer.pack(PLAYER, game.player_x, game.player_y, game.level, game.attack, game.xp, game.gold,
+                    game.health, game.max_health, game.time, game.turn)
+        self.append(PLAYER_RECORD, writer)
+
+    def place(self, game):
+        writer = SaveWriter()
+        in_dungeon = game.dungeon_key is not None
+        writer.pack(PLACE, *game.current_cell, *game.selected_cell, game.hud_visible, in_dungeon)
+        if in_dungeon:
+            writer.pack(DUNGEON, game.dungeon_level, game.max_dungeon_level, *game.dungeon_entrance_position)
+        writer.string(game.local_map_biome)
+        self.append(PLACE_RECORD, writer)
+
+    def tile(self, game, x, y, tile_id):
+        writer = SaveWriter()
+        self.map_key(writer, game)
+        writer.pack(TILE, y * game.local_map.width + x, tile_id)
+        self.append(TILE_RECORD, writer)
+
+    def entities(self, game):
+        writer = SaveWriter()
+        self.map_key(writer, game)
+        writer.pack(POSITION, game.player_x, game.player_y)
+        writer.enemies(game.enemies)
+        writer.villagers(game.villagers)
+        self.append(ENTITIES_RECORD, writer)
+
+    def inventory(self, game):
+        writer = SaveWriter()
+        writer.strings(game.inventory)
+        writer.strings(game.equipped_items)
+        self.append(INVENTORY_RECORD, writer)
+
+
+def read_journal(path, journal_id):
+    # The decoded records of a journal, up to the first damaged one. A missing
+    # journal, or one following another snapshot, has no records.
+    try:
+        with open(path, 'rb') as journal_file:
+            data = journal_file.read()
+    except FileNotFoundError:
+        return []
+    if len(data) < JOURNAL_HEADER.size or JOURNAL_HEADER.unpack_from(data) != (JOURNAL_MAGIC, journal_id):
+        return []
+    records = []
+    offset = JOURNAL_HEADER.size
+    while offset + FRAME.size <= len(data):
+        length, checksum = FRAME.unpack_from(data, offset)
+        payload = data[offset + FRAME.size:offset + FRAME.size + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            break
+        try:
+            records.append(decode_record(SaveReader(payload)))
+        except (ValueError, struct.error, IndexError):
+            break
+        offset += FRAME.size + length
+    return records
+
+
+def decode_record(reader):
+    record_type, = reader.unpack(RECORD_TYPE)
+    if record_type == PLAYER_RECORD:
+        values = reader.unpack(PLAYER)
+    elif record_type == PLACE_RECORD:
+        place = reader.unpack(PLACE)
+        dungeon = reader.unpack(DUNGEON) if place[5] else None
+        values = (place, dungeon, reader.string())
+    elif record_type == TILE_RECORD:
+        values = (read_map_key(reader),) + reader.unpack(TILE)
+    elif record_type == ENTITIES_RECORD:
+        values = (read_map_key(reader), reader.unpack(POSITION), reader.enemies(), reader.villagers())
+    elif record_type == INVENTORY_RECORD:
+        values = (reader.strings(), reader.strings())
+    else:
+        raise ValueError(f'Unknown journal record type {record_type}')
+    return record_type, values
+
+
+def read_map_key(reader):
+    in_dungeon, cell_x, cell_y, entrance_x, entrance_y, level = reader.unpack(MAP_KEY)
+    if in_dungeon:
+        return True, ((cell_x, cell_y), (entrance_x, entrance_y), level)
+    return False, (cell_x, cell_y)
+
+
+def recover_game(game, snapshot_path=AUTOSAVE_FILE):
+    # Load the last snapshot and replay its journal on top. Raises like
+    # savegame.load_game; returns the number of journal records replayed.
+    journal_id = savegame.load_game(game, snapshot_path)
+    records = read_journal(snapshot_path + '.journal', journal_id)
+    if records and game.map_stack:
+        # Nothing is journaled inside a building, so records following a
+        # snapshot taken in one were made after the player left it: replay
+        # them outdoors, on the cell the buildings were entered from
+        outdoors = game.map_stack[0]
+        game.current_cell = outdoors['current_cell']
+        game.local_map_biome = outdoors['local_map_biome']
+        game.map_stack = []
+    for record_type, values in records:
+        replay_record(game, record_type, values)
+    if records:
+        restore_current_map(game)
+    return len(records)
+
+
+def replay_record(game, record_type, values):
+    if record_type == PLAYER_RECORD:
+        (game.player_x, game.player_y, game.level, game.attack, game.xp, game.gold,
+         game.health, game.max_health, game.time, game.turn) = values
+    elif record_type == PLACE_RECORD:
+        place, dungeon, game.local_map_biome = values
+        game.current_cell = place[0], place[1]
+        game.selected_cell = place[2], place[3]
+        game.hud_visible = place[4]
+        game.map_stack = []
+        if dungeon is not None:
+            game.dungeon_level, game.max_dungeon_level = dungeon[0], dungeon[1]
+            game.dungeon_entrance_position = (dungeon[2], dungeon[3])
+            game.dungeon_key = (game.current_cell, game.dungeon_entrance_position, game.dungeon_level)
+            game.state = 'dungeon'
+        else:
+            game.dungeon_key = None
+            game.state = 'local_map'
+    elif record_type == TILE_RECORD:
+        map_key, index, tile_id = values
+        map_record(game, map_key)['tiles'][index] = tile_id
+    elif record_type == ENTITIES_RECORD:
+        map_key, (player_x, player_y), enemies, villagers = values
+        record = map_record(game, map_key)
+        record['enemies'] = enemies
+        if not map_key[0]:
+            record['villagers'] = villagers
+            record['player_x'], record['player_y'] = player_x, player_y
+    elif record_type == INVENTORY_RECORD:
+        game.inventory, game.equipped_items = values
+
+
+def map_record(game, map_key):
+    # The stored state of a cell or dungeon level, created as it is first
+    # generated if the snapshot predates the first visit
+    in_dungeon, key = map_key
+    store = game.dungeon_levels if in_dungeon else game.world_cells
+    if key not in store:
+        if in_dungeon:
+            store[key] = {'tiles': {}, 'enemies': [], 'explored': explored_bits(LOCAL_MAP_WIDTH, LOCAL_MAP_HEIGHT)}
+        else:
+            store[key] = {
+                'tiles': {},
+                'player_x': LOCAL_MAP_WIDTH // 2,
+                'player_y': LOCAL_MAP_HEIGHT // 2,
+                'enemies': [],
+                'villagers': [],
+                'biome': game.world_map.cell(*key)['biome'],
+                'explored': explored_bits(LOCAL_MAP_WIDTH, LOCAL_MAP_HEIGHT),
+                'simulated_turn': game.turn,
+            }
+    return store[key]
+
+
+def restore_current_map(game):
+    # Rebuild the map the journal left the player on, linked to its stored state
+    game.world_map.keep_around(game.current_cell)
+    if game.dungeon_key is not None:
+        cell, entrance, level = game.dungeon_key
+        game.local_map, _ = worldgen.generate_dungeon_level(game.world_seed, cell, entrance, level, game.max_dungeon_level)
+        dungeon_data = map_record(game, (True, game.dungeon_key))
+        game.local_map.apply_changes(dungeon_data['tiles'])
+        game.local_map.explored = dungeon_data['explored']
+        game.enemies = dungeon_data['enemies']
+        game.villagers = []
+    else:
+        cell_data = map_record(game, (False, game.current_cell))
+        game.local_map = game.load_cell_map(game.current_cell)
+        game.enemies = cell_data['enemies']
+        game.villagers = cell_data['villagers']
@@ -1,71 +1,36 @@
 # roguelike_pygame_worldmap_updated.py
 
 import pygame
+import struct
 import sys
+import functools
+import math
+import os
 import random
-import time
 import textwrap
 from config import *
-
-class Enemy:
-    def __init__(self, x, y, enemy_type):
-        self.x = x
-        self.y = y
-        stats = ENEMY_STATS[enemy_type]
-        self.char = stats['char']
-        self.color = stats['color']
-        self.name = enemy_type
-        self.attack = random.randint(*stats['attack'])
-        self.health = stats['health']
-        self.max_health = stats['health']
-        self.xp = stats['xp']
-        self.gold = random.randint(*stats['gold'])
-        self.behavior = stats['behavior']
-
-    def move(self, player_x, player_y, local_map, time_of_day):
-        if self.behavior == 'aggressive':
-            # Simple line-of-sight check (Manhattan distance)
-            distance = abs(self.x - player_x) + abs(self.y - player_y)
-            if distance <= 10:
-                dx = player_x - self.x
-                dy = player_y - self.y
-                if abs(dx) > abs(dy):
-                    step_x = 1 if dx > 0 else -1
-                    if TILES[local_map[self.y][self.x + step_x]]['walkable']:
-                        self.x += step_x
-                else:
-                    step_y = 1 if dy > 0 else -1
-                    if TILES[local_map[self.y + step_y][self.x]]['walkable']:
-                        self.y += step_y
-        elif self.behavior == 'random':
-            # Move randomly
-            dx = random.choice([-1, 0, 1])
-            dy = random.choice([-1, 0, 1])
-            new_x = self.x + dx
-            new_y = self.y + dy
-            if 0 <= new_x < LOCAL_MAP_WIDTH and 0 <= new_y < LOCAL_MAP_HEIGHT:
-                if TILES[local_map[new_y][new_x]]['walkable']:
-                    self.x = new_x
-                    self.y = new_y
-
-class Villager:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
-        self.char = VILLAGER_STATS['char']
-        self.color = VILLAGER_STATS['color']
-        self.name = 'Villager'
-
-    def move(self, local_map):
-        # Simple random walk within town area
-        dx = random.choice([-1, 0, 1])
-        dy = random.choice([-1, 0, 1])
-        new_x = self.x + dx
-        new_y = self.y + dy
-        if 0 <= new_x < LOCAL_MAP_WIDTH and 0 <= new_y < LOCAL_MAP_HEIGHT:
-            if TILES[local_map[new_y][new_x]]['walkable']:
-                self.x = new_x
-                self.y = new_y
+import worldgen
+import savegame
+from journal import AutosaveJournal, recover_game
+from cellstore import CellStore
+from prefetch import CellPrefetcher, DungeonPrefetcher
+from tilemap import TileMap
+from fov import FieldOfView
+from travel import TravelPlanner
+from entities import Enemy, EntityGrid, Villager
+from render import DamageTracker, FogLayer, GlyphAtlas, TerrainCache, WorldMapCache, tile_glyphs
+
+# Combat screen layout
+ATTACK_BAR = pygame.Rect((WINDOW_WIDTH - 300) // 2, WINDOW_HEIGHT // 2 - 100, 300, 20)
+INDICATOR_WIDTH = 10
+
+# Fired when the player runs out of time for a defense-phase arrow
+DEFENSE_TIMEOUT = pygame.event.custom_type()
+
+@functools.lru_cache(maxsize=256)
+def wrap_event(event):
+    # Event strings never change, so their wrapped lines are cached
+    return textwrap.wrap(event, width=30)  # Adjust width as needed
 
 class Game:
     def __init__(self):
@@ -73,7 +38,7 @@ class Game:
         self.screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
         pygame.display.set_caption('Valdmir')
         self.clock = pygame.time.Clock()
-        self.font = pygame.font.SysFont(FONT_NAME, FONT_SIZE)
+        self.font = get_font()
         self.running = True
 
         # Game state
@@ -82,6 +47,8 @@ class Game:
         # Player variables
         self.player_char = '@'
         self.player_color = WHITE
+        self.glyph_atlas = GlyphAtlas(self.font, tile_glyphs(self.player_char, self.player_color))
+        self.terrain_cache = TerrainCache(self.glyph_atlas)
         self.player_x = 0
         self.player_y = 0
         self.level = 1
@@ -92,7 +59,7 @@ class Game:
         self.equipped_items = []
 
         # Current cell position in world map
-        self.current_cell = (WORLD_MAP_WIDTH // 2, WORLD_MAP_HEIGHT // 2)
+        self.current_cell = (0, 0)
         self.selected_cell = self.current_cell
 
         # Game variables
@@ -103,25 +70,35 @@ class Game:
 
         # Time variables
         self.time = INITIAL_TIME
+        self.turn = 0  # Player turns taken; game time advances once per turn
 
-        # World map
-        self.world_map = self.generate_world_map()
-
-        # Local maps for each world cell
-        self.world_cells = {}  # Key: (cell_x, cell_y), Value: {'local_map', 'player_x', 'player_y', 'enemies', 'villagers'}
+        # World map; every local map and dungeon level is generated from the world seed
+        self.prefetcher = None
+        self.dungeon_prefetcher = None
+        self.start_world(random.randrange(2 ** 32))
 
         # Map stack to handle multiple map levels
         self.map_stack = []
+        self.dungeon_key = None  # Store key of the dungeon level in play, None above ground
+
+        # Autosave: a snapshot of the game plus a journal of what changed since
+        self.autosave_file = AUTOSAVE_FILE
+        self.journal = None
+        self.journaled_place = None
 
         # Enemies
         self.enemies = []
 
         # Villagers
         self.villagers = []
+        self.occupancy = None  # EntityGrid of the enemies and villagers above, see entity_grid()
+        self.fov = FieldOfView()  # What the player sees, see update_fov()
 
         # Combat variables
         self.in_combat = False
         self.current_enemy = None
+        self.arrow_images = None
+        self.combat_scene = None
 
         # Command mode
         self.command_mode = False
@@ -130,95 +107,65 @@ class Game:
         # HUD visibility
         self.hud_visible = True  # New variable to track HUD visibility
 
-    def generate_world_map(self):
-        world_map = [[{'biome': 'PLAIN', 'town': False, 'dungeons': [], 'name': None} for _ in range(WORLD_MAP_WIDTH)] for _ in range(WORLD_MAP_HEIGHT)]
-
-        # Scatter blobs of other biomes
-        num_blobs = 60  # Increased number for larger map
-        for _ in range(num_blobs):
-            biome = random.choice(['FOREST', 'MOUNTAIN', 'DESERT', 'WATER'])
-            blob_size = random.randint(2, 5)
-            blob_x = random.randint(0, WORLD_MAP_WIDTH - 1)
-            blob_y = random.randint(0, WORLD_MAP_HEIGHT - 1)
-            self.create_biome_blob(world_map, blob_x, blob_y, blob_size, biome)
-
-        # Place towns/villages
-        num_towns = 20  # Increased number of towns
-        for _ in range(num_towns):
-            town_x = random.randint(0, WORLD_MAP_WIDTH - 1)
-            town_y = random.randint(0, WORLD_MAP_HEIGHT - 1)
-            world_map[town_y][town_x]['town'] = True
-
-        # Place dungeons
-        for y in range(WORLD_MAP_HEIGHT):
-            for x in range(WORLD_MAP_WIDTH):
-                if random.random() < 0.5:
-                    num_dungeons = random.randint(1, 3)
-                    dungeon_positions = []
-                    for _ in range(num_dungeons):
-                        dungeon_positions.append(self.random_dungeon_position())
-                    world_map[y][x]['dungeons'] = dungeon_positions
-
-        return world_map
-
-    def random_dungeon_position(self):
-        # Return a random position within the local map bounds
-        x = random.randint(5, LOCAL_MAP_WIDTH - 6)  # Avoid edges
-        y = random.randint(5, LOCAL_MAP_HEIGHT - 6)
-        return (x, y)
-
-    def create_biome_blob(self, world_map, x, y, size, biome):
-        cells_to_fill = [(x, y)]
-        for _ in range(size):
-            if cells_to_fill:
-                cx, cy = cells_to_fill.pop(0)
-                if 0 <= cx < WORLD_MAP_WIDTH and 0 <= cy < WORLD_MAP_HEIGHT:
-                    world_map[cy][cx]['biome'] = biome
-                    # Add neighboring cells
-                    neighbors = [
-                        (cx + 1, cy), (cx - 1, cy),
-                        (cx, cy + 1), (cx, cy - 1)
-                    ]
-                    random.shuffle(neighbors)
-                    cells_to_fill.extend(neighbors[:2])
+        # Screen damage tracking: what is currently on screen, so each frame
+        # only redraws and presents the regions that changed
+        self.damage = DamageTracker(self.screen)
+        self.scene = None
+        self.drawn_view = None
+        self.drawn_entities = []
+        self.drawn_fov = None  # (revision, box) of the field of view last drawn
+        self.fog_layer = None  # FogLayer of the map drawn
+        self.panel_surface = pygame.Surface((WINDOW_WIDTH - VIEWPORT_WIDTH * TILE_SIZE, WINDOW_HEIGHT))
+        self.panel_key = None
+        self.drawn_world_marks = None
+        self.drawn_world_camera = None
+        self.drawn_command = None
+
+    def start_world(self, world_seed):
+        # A fresh world for the seed, with no cells visited yet
+        self.world_seed = world_seed
+        self.world_map = worldgen.WorldMap(self.world_seed)
+        self.world_map_cache = WorldMapCache(self.world_map)
+        # Top-left world cell shown on the world map screen, starting with the current cell centered
+        self.world_camera = (self.current_cell[0] - WINDOW_WIDTH // CELL_SIZE // 2,
+                             self.current_cell[1] - (WINDOW_HEIGHT - 60) // CELL_SIZE // 2)
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown()
+            self.dungeon_prefetcher.shutdown()
+        self.prefetcher = CellPrefetcher(self.world_seed, self.world_map, self.glyph_atlas)
+        self.dungeon_prefetcher = DungeonPrefetcher(self.world_seed)
+        self.travel_planner = TravelPlanner(self.world_map)
+
+        # State of visited world cells and dungeon levels. Maps are rebuilt from
+        # the seed on each visit, so only the tiles changed since generation are kept.
+        # Both stores spill their least recently visited entries to disk.
+        self.world_cells = CellStore()  # Key: (cell_x, cell_y), Value: {'tiles', 'player_x', 'player_y', 'enemies', 'villagers', 'biome'}
+        self.dungeon_levels = CellStore()  # Key: (cell, entrance, level), Value: {'tiles', 'enemies'}
 
     def generate_local_map(self, cell_x, cell_y, entrance_direction=None):
         cell_key = (cell_x, cell_y)
         if cell_key in self.world_cells:
-            # Load existing local map and state
+            # Rebuild the local map and restore the cell's state
             cell_data = self.world_cells[cell_key]
-            self.local_map = cell_data['local_map']
+            self.local_map = self.load_cell_map(cell_key)
             self.player_x = cell_data['player_x']
             self.player_y = cell_data['player_y']
             self.enemies = cell_data['enemies']
             self.villagers = cell_data['villagers']
             self.local_map_biome = cell_data['biome']
+            self.catch_up_cell(cell_key, cell_data)
             return self.local_map
         else:
             # Generate new local map
             # Get the biome of the selected cell
-            cell_data = self.world_map[cell_y][cell_x]
+            cell_data = self.world_map.cell(cell_x, cell_y)
             biome = cell_data['biome']
             self.local_map_biome = biome
 
-            # Initialize the local map here
-            self.local_map = [[None for _ in range(LOCAL_MAP_WIDTH)] for _ in range(LOCAL_MAP_HEIGHT)]
-
             # Generate the local map based on the biome
-            for y in range(LOCAL_MAP_HEIGHT):
-                for x in range(LOCAL_MAP_WIDTH):
-                    tile = self.generate_tile(biome)
-                    self.local_map[y][x] = tile
-
-            # Optionally, add features based on whether the cell contains a town
+            self.local_map = self.build_cell_map(cell_key)
             if cell_data['town']:
-                self.place_town(self.local_map)
-
-            # Place dungeon entrances if any
-            cell_data = self.world_map[cell_y][cell_x]
-            for dungeon_pos in cell_data.get('dungeons', []):
-                x, y = dungeon_pos
-                self.local_map[y][x] = 'DUNGEON_ENTRANCE'
+                self.events.append('You have entered a town.')
 
             # Set player's position based on entrance direction
             if entrance_direction is None:
@@ -244,31 +191,19 @@ class Game:
                     self.player_x = LOCAL_MAP_WIDTH // 2
                     self.player_y = LOCAL_MAP_HEIGHT // 2
 
-            # Ensure player's starting position is walkable
-            attempts = 0
-            max_attempts = LOCAL_MAP_WIDTH * LOCAL_MAP_HEIGHT
-            while True:
-                tile = self.local_map[self.player_y][self.player_x]
-                if TILES[tile]['walkable']:
-                    break
-                else:
-                    # Adjust position if not walkable
-                    if entrance_direction == 'left':
-                        self.player_x += 1
-                    elif entrance_direction == 'right':
-                        self.player_x -= 1
-                    elif entrance_direction == 'up':
-                        self.player_y += 1
-                    elif entrance_direction == 'down':
-                        self.player_y -= 1
-                    else:
-                        # Random position
-                        self.player_x = random.randint(0, LOCAL_MAP_WIDTH - 1)
-                        self.player_y = random.randint(0, LOCAL_MAP_HEIGHT - 1)
-                    attempts += 1
-                    if attempts > max_attempts:
-                        # No walkable tile found
-                        raise Exception('No walkable tile found for player to start')
+            # Ensure player's starting position is walkable: step inward from
+            # the edge entered, or failing that take a random open tile
+            step_x, step_y = {'left': (1, 0), 'right': (-1, 0), 'up': (0, 1), 'down': (0, -1)}.get(entrance_direction, (0, 0))
+            while (step_x or step_y) and self.local_map.in_bounds(self.player_x, self.player_y) \
+                    and not self.local_map.walkable(self.player_x, self.player_y):
+                self.player_x += step_x
+                self.player_y += step_y
+            if not self.local_map.walkable(self.player_x, self.player_y):
+                position = self.local_map.index().random_open(random)
+                if position is None:
+                    # No walkable tile found
+                    raise Exception('No walkable tile found for player to start')
+                self.player_x, self.player_y = position
 
             # Initialize enemies and villagers
             self.enemies = []
@@ -277,153 +212,196 @@ class Game:
             # Determine time of day
             time_of_day = self.get_time_of_day()
 
+            rng = worldgen.cell_rng(self.world_seed, cell_x, cell_y, 'spawns')
             if self.state == 'dungeon':
                 # Do not spawn villagers in the dungeon
-                self.spawn_dungeon_enemies()
+                self.spawn_dungeon_enemies(rng)
             else:
                 if cell_data['town']:
                     # Spawn villagers during the day
                     if time_of_day == 'day':
-                        self.spawn_villagers(self.local_map)
+                        self.spawn_villagers(self.local_map, rng)
                 else:
-                    self.spawn_enemies(self.local_map, time_of_day)
+                    self.spawn_enemies(self.local_map, time_of_day, rng)
 
             # Save the new cell's state
             self.world_cells[cell_key] = {
-                'local_map': self.local_map,
+                'tiles': self.local_map.changes,
                 'player_x': self.player_x,
                 'player_y': self.player_y,
                 'enemies': self.enemies,
                 'villagers': self.villagers,
                 'biome': self.local_map_biome,
+                'explored': self.local_map.explored,
+                'simulated_turn': self.turn,
             }
             return self.local_map
 
-    def spawn_villagers(self, local_map):
-        num_villagers = random.randint(3, 6)
+    def load_cell_map(self, cell_key):
+        # Regenerate a visited cell's local map and replay the changes made to
+        # it; what was explored is kept with the cell
+        local_map = self.build_cell_map(cell_key)
+        cell_data = self.world_cells[cell_key]
+        local_map.apply_changes(cell_data['tiles'])
+        local_map.explored = cell_data['explored']
+        for index in local_map.changes:
+            self.terrain_cache.mark_dirty(local_map, index % local_map.width, index // local_map.width)
+        return local_map
+
+    def catch_up_cell(self, cell_key, cell_data):
+        # Cells are not simulated while the player is away. On their return
+        # the turns missed are made up in one step: entities end up about as
+        # far as that many random steps would take them, enemies leave and new
+        # ones arrive with a chance per turn, and villagers are only out by day.
+        elapsed = self.turn - cell_data['simulated_turn']
+        cell_data['simulated_turn'] = self.turn
+        if elapsed <= 0:
+            return
+        rng = worldgen.cell_rng(self.world_seed, cell_key[0], cell_key[1], f'catch-up/{self.turn}')
+        survival = (1 - CATCH_UP_DESPAWN_CHANCE) ** elapsed
+        self.enemies[:] = [enemy for enemy in self.enemies if rng.random() < survival]
+
+        # Steps of -1, 0 or 1 have a variance of 2/3 on each axis, so after
+        # elapsed steps the distance moved is close to normally distributed
+        spread = math.sqrt(elapsed * 2 / 3)
+        taken = self.occupied_positions()
+        for entity in self.enemies + self.villagers:
+            new_x = entity.x + round(rng.gauss(0, spread))
+            new_y = entity.y + round(rng.gauss(0, spread))
+            if self.local_map.walkable(new_x, new_y) and (new_x, new_y) not in taken:
+                taken.discard((entity.x, entity.y))
+                taken.add((new_x, new_y))
+                entity.x, entity.y = new_x, new_y
+
+        time_of_day = self.get_time_of_day()
+        if self.world_map.cell(*cell_key)['town']:
+            if time_of_day == 'night':
+                self.villagers.clear()
+            elif not self.villagers:
+                self.spawn_villagers(self.local_map, rng)
+        elif rng.random() >= (1 - CATCH_UP_RESPAWN_CHANCE) ** elapsed:
+            self.spawn_enemies(self.local_map, time_of_day, rng)
+            del self.enemies[CELL_ENEMY_LIMIT:]
+
+    def build_cell_map(self, cell_key):
+        # A cell's map as generated, picked up from the prefetcher if it was built ahead
+        prefetched = self.prefetcher.take(cell_key)
+        if prefetched is None:
+            cell_x, cell_y = cell_key
+            return worldgen.generate_cell_map(self.world_seed, cell_x, cell_y, self.world_map.cell(cell_x, cell_y))
+        local_map, layer = prefetched
+        self.terrain_cache.add(layer)
+        return local_map
+
+    def prefetch_neighbors(self):
+        # Build the cells past every local map edge the player is close to
+        cell_x, cell_y = self.current_cell
+        cells = []
+        if self.player_x < PREFETCH_DISTANCE:
+            cells.append((cell_x - 1, cell_y))
+        if self.player_x >= LOCAL_MAP_WIDTH - PREFETCH_DISTANCE:
+            cells.append((cell_x + 1, cell_y))
+        if self.player_y < PREFETCH_DISTANCE:
+            cells.append((cell_x, cell_y - 1))
+        if self.player_y >= LOCAL_MAP_HEIGHT - PREFETCH_DISTANCE:
+            cells.append((cell_x, cell_y + 1))
+        self.prefetcher.prefetch(cells)
+
+        # And every level of the dungeons whose entrance is close
+        dungeons = []
+        for entrance_x, entrance_y in self.world_map.cell(cell_x, cell_y)['dungeons']:
+            if max(abs(entrance_x - self.player_x), abs(entrance_y - self.player_y)) <= DUNGEON_PREFETCH_DISTANCE:
+                dungeons.append((self.current_cell, (entrance_x, entrance_y)))
+        self.dungeon_prefetcher.prefetch(dungeons)
+
+    def occupied_positions(self):
+        # Positions held by the player and every entity, so spawns never stack
+        taken = {(entity.x, entity.y) for entity in self.enemies + self.villagers}
+        taken.add((self.player_x, self.player_y))
+        return taken
+
+    def spawn_villagers(self, local_map, rng):
+        num_villagers = rng.randint(3, 6)
+        tile_index = local_map.index()
+        taken = self.occupied_positions()
         for _ in range(num_villagers):
-            while True:
-                x = random.randint(0, LOCAL_MAP_WIDTH - 1)
-                y = random.randint(0, LOCAL_MAP_HEIGHT - 1)
-                tile_type = local_map[y][x]
-                tile = TILES.get(tile_type, TILES['PLAIN'])
-                if tile['walkable'] and (x != self.player_x or y != self.player_y):
-                    self.villagers.append(Villager(x, y))
-                    break
+            position = tile_index.random_open(rng, taken)
+            if position is not None:
+                taken.add(position)
+                self.villagers.append(Villager(*position))
 
-    def spawn_enemies(self, local_map, time_of_day):
-        num_enemies = random.randint(3, 6)
+    def spawn_enemies(self, local_map, time_of_day, rng):
+        num_enemies = rng.randint(3, 6)
         enemy_types = ['Goblin', 'Snake', 'Bandit']
         if time_of_day == 'night':
             enemy_types.append('Bat')
+        tile_index = local_map.index()
+        taken = self.occupied_positions()
         for _ in range(num_enemies):
-            enemy_type = random.choice(enemy_types)
-            while True:
-                x = random.randint(0, LOCAL_MAP_WIDTH - 1)
-                y = random.randint(0, LOCAL_MAP_HEIGHT - 1)
-                tile_type = local_map[y][x]
-                tile = TILES.get(tile_type, TILES['PLAIN'])
-                if tile['walkable'] and (x != self.player_x or y != self.player_y):
-                    self.enemies.append(Enemy(x, y, enemy_type))
-                    break
-
-    def place_town(self, local_map):
-        # Place a town in the local map
-        town_center_x = LOCAL_MAP_WIDTH // 2
-        town_center_y = LOCAL_MAP_HEIGHT // 2
-        town_size = 20  # Adjust the size of the town
-        num_buildings = 5  # Number of buildings
-        building_size = 6  # Size of each building
-
-        # Clear the town area to plains
-        for y in range(town_center_y - town_size // 2, town_center_y + town_size // 2):
-            for x in range(town_center_x - town_size // 2, town_center_x + town_size // 2):
-                if 0 <= x < LOCAL_MAP_WIDTH and 0 <= y < LOCAL_MAP_HEIGHT:
-                    local_map[y][x] = 'PLAIN'  # Walkable area
-
-        # Place buildings
-        for i in range(num_buildings):
-            # Randomly position buildings within the town area
-            b_x = random.randint(town_center_x - town_size // 2, town_center_x + town_size // 2 - building_size)
-            b_y = random.randint(town_center_y - town_size // 2, town_center_y + town_size // 2 - building_size)
-            # Build building
-            for y in range(b_y, b_y + building_size):
-                for x in range(b_x, b_x + building_size):
-                    if 0 <= x < LOCAL_MAP_WIDTH and 0 <= y < LOCAL_MAP_HEIGHT:
-                        # Walls on the edges
-                        if y == b_y or y == b_y + building_size -1 or x == b_x or x == b_x + building_size -1:
-                            local_map[y][x] = 'HOUSE_WALL'
-                        else:
-                            local_map[y][x] = 'HOUSE_FLOOR'
-            # Place door
-            door_side = random.choice(['top', 'bottom', 'left', 'right'])
-            if door_side == 'top':
-                door_x = random.randint(b_x + 1, b_x + building_size - 2)
-                door_y = b_y
-            elif door_side == 'bottom':
-                door_x = random.randint(b_x + 1, b_x + building_size - 2)
-                door_y = b_y + building_size -1
-            elif door_side == 'left':
-                door_x = b_x
-                door_y = random.randint(b_y + 1, b_y + building_size - 2)
-            elif door_side == 'right':
-                door_x = b_x + building_size -1
-                door_y = random.randint(b_y + 1, b_y + building_size - 2)
-            local_map[door_y][door_x] = 'DOOR'
-        self.events.append('You have entered a town.')
-
-    def generate_tile(self, biome):
-        # Based on the biome, decide what tiles to generate
-        if biome == 'PLAIN':
-            # Mostly plains, with a chance for small features
-            chance = random.random()
-            if chance < 0.05:
-                return 'FOREST'
-            elif chance < 0.06:
-                return 'MOUNTAIN'
-            else:
-                return 'PLAIN'
-        elif biome == 'FOREST':
-            # Mostly forest
-            chance = random.random()
-            if chance < 0.7:
-                return 'FOREST'
-            else:
-                return 'PLAIN'
-        elif biome == 'MOUNTAIN':
-            # Mostly mountains
-            chance = random.random()
-            if chance < 0.7:
-                return 'MOUNTAIN'
-            else:
-                return 'PLAIN'
-        elif biome == 'DESERT':
-            # Mostly desert
-            chance = random.random()
-            if chance < 0.1:
-                return 'MOUNTAIN'
-            else:
-                return 'DESERT'
-        elif biome == 'WATER':
-            # Mostly water
-            chance = random.random()
-            if chance < 0.9:
-                return 'WATER'
-            else:
-                return 'PLAIN'
-        else:
-            return 'PLAIN'
+            enemy_type = rng.choice(enemy_types)
+            position = tile_index.random_open(rng, taken)
+            if position is not None:
+                taken.add(position)
+                self.enemies.append(Enemy(*position, enemy_type, rng))
 
     def run(self):
+        # Mouse input is unused; keep it from waking the loop
+        pygame.event.set_blocked([pygame.MOUSEMOTION, pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP, pygame.MOUSEWHEEL])
         while self.running:
-            self.clock.tick(FPS)
-            self.handle_events()
-            if self.state != 'combat':
-                self.update_time()
             self.draw()
+            self.clock.tick(FPS)  # Caps the frame rate while input arrives quickly
+            # Nothing animates outside the combat screens, so sleep until there is input
+            self.handle_events(wait=True)
+        self.prefetcher.shutdown()
+        self.dungeon_prefetcher.shutdown()
+        if self.journal is not None:
+            self.journal.close()
         pygame.quit()
         sys.exit()
 
+    def end_turn(self):
+        # One player action is one turn: the world moves and the clock advances
+        self.move_entities()
+        self.turn += 1
+        self.update_time()
+        self.autosave()
+
+    def start_autosave(self):
+        # Write a fresh snapshot; the journal then follows on from it
+        if self.autosave_file is None:
+            return
+        if self.journal is None:
+            self.journal = AutosaveJournal(self.autosave_file)
+        self.journal.snapshot(self)
+        self.journaled_place = (self.current_cell, self.dungeon_key)
+
+    def active_journal(self):
+        # None with autosave off, or inside a building, whose maps are not kept
+        if self.journal is None or self.map_stack:
+            return None
+        if self.journal.error is not None:
+            self.events.append(f'Autosave stopped: {self.journal.error}')
+            self.journal = None
+        return self.journal
+
+    def autosave(self):
+        # Journal what the turn changed: where the player is, their stats and
+        # the entities of the map in play. A new snapshot replaces the journal
+        # once it is long enough, outside combat so the snapshot can be resumed.
+        journal = self.active_journal()
+        if journal is None:
+            return
+        place = (self.current_cell, self.dungeon_key)
+        if journal.records >= AUTOSAVE_SNAPSHOT_RECORDS and self.state in ('local_map', 'dungeon'):
+            journal.snapshot(self)
+            self.journaled_place = place
+            return
+        if place != self.journaled_place:
+            journal.place(self)
+            self.journaled_place = place
+        journal.player(self)
+        journal.entities(self)
+
     def update_time(self):
         # Increment time by TIME_INCREMENT minutes per turn
         self.time = (self.time + TIME_INCREMENT) % (24 * 60)  # Wrap around after 24 hours
@@ -434,15 +412,26 @@ class Game:
         else:
             return 'night'
 
-    def handle_events(self):
+    def handle_events(self, wait=False):
+        events = pygame.event.get()
+        if wait and not events:
+            events = [pygame.event.wait()] + pygame.event.get()
         keys = pygame.key.get_pressed()
-        for event in pygame.event.get():
+        for event in events:
             if event.type == pygame.QUIT:
                 self.running = False
 
+            elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                # The window was uncovered or restored; repaint all of it
+                self.damage.invalidate()
+
             elif event.type == pygame.KEYDOWN:
                 if self.state == 'main_menu':
-                    self.state = 'world_map'  # Start the game
+                    if event.key == pygame.K_r and self.has_autosave():
+                        # Resume the game left unfinished; a new one starts if that fails
+                        self.recover_game()
+                    if self.state == 'main_menu':
+                        self.state = 'world_map'  # Start the game
                 elif self.command_mode:
                     self.handle_command_input(event)
                 else:
@@ -454,9 +443,12 @@ class Game:
                     if event.key == pygame.K_m:
                         # Toggle Map Mode
                         if self.state == 'local_map':
+                            # Open the map on the player's cell, not where the last look left it
                             self.state = 'map_mode'
+                            self.selected_cell = self.current_cell
                         elif self.state == 'map_mode':
                             self.state = 'local_map'
+                            self.world_map.keep_around(self.current_cell)
 
                     if self.state in ('world_map', 'map_mode'):
                         self.handle_world_map_events(event)
@@ -466,9 +458,10 @@ class Game:
     
     def handle_command_input(self, event):
         if event.key == pygame.K_RETURN:
-            # Process command
-            self.process_command(self.command_input.strip())
+            # Close the overlay first: commands such as travel redraw the map
+            # while they run
             self.command_mode = False
+            self.process_command(self.command_input.strip())
         elif event.key == pygame.K_BACKSPACE:
             self.command_input = self.command_input[:-1]
         else:
@@ -490,12 +483,164 @@ class Game:
             self.events.append(f'HUD is now {state}.')
         elif command == 'regioninfo':
             self.display_region_info()
+        elif command == 'save':
+            self.save_game()
+        elif command == 'load':
+            self.load_game()
+        elif command == 'recover':
+            self.recover_game()
+        elif command.split()[:1] == ['travel']:
+            self.travel_command(command.split()[1:])
         else:
             self.events.append(f'Unknown command: {command}')
 
+    def save_game(self):
+        if self.state not in ('local_map', 'map_mode', 'dungeon'):
+            self.events.append('Nothing to save yet.')
+            return
+        try:
+            savegame.save_game(self, SAVE_FILE)
+        except OSError as error:
+            self.events.append(f'Could not save: {error}')
+        else:
+            self.events.append(f'Game saved to {SAVE_FILE}.')
+
+    def load_game(self):
+        try:
+            savegame.load_game(self, SAVE_FILE)
+        except (OSError, ValueError, struct.error) as error:
+            self.events.append(f'Could not load: {error}')
+            return
+        self.in_combat = False
+        self.current_enemy = None
+        self.damage.invalidate()
+        self.events.append(f'Game loaded from {SAVE_FILE}.')
+        self.start_autosave()
+
+    def has_autosave(self):
+        # An autosave left by an earlier session is kept until the player
+        # chooses whether to resume it; a new game overwrites it on spawning
+        return self.autosave_file is not None and os.path.exists(self.autosave_file)
+
+    def recover_game(self):
+        # Resume from the autosave: its last snapshot plus the journal written after it
+        if self.autosave_file is None:
+            self.events.append('Autosave is off.')
+            return
+        if self.journal is not None:
+            # Finish writing the journal before reading it back
+            self.journal.close()
+            self.journal = None
+        try:
+            replayed = recover_game(self, self.autosave_file)
+        except (OSError, ValueError, struct.error) as error:
+            self.events.append(f'Could not recover: {error}')
+            return
+        self.in_combat = False
+        self.current_enemy = None
+        self.damage.invalidate()
+        self.events.append(f'Recovered autosave and {replayed} journal records.')
+        self.start_autosave()
+
+    def travel_command(self, args):
+        # travel X Y walks to a position on the local map, travel cell X Y to a world cell
+        if self.state != 'local_map' or self.map_stack:
+            self.events.append('You can only travel in the open.')
+            return
+        try:
+            if len(args) == 3 and args[0] == 'cell':
+                target = (int(args[1]), int(args[2]))
+            elif len(args) == 2:
+                target = None
+                x, y = int(args[0]), int(args[1])
+            else:
+                raise ValueError
+        except ValueError:
+            self.events.append('Usage: travel X Y, or travel cell X Y')
+            return
+        if target is not None:
+            self.travel_to_cell(target)
+        elif not self.local_map.walkable(x, y):
+            self.events.append(f'Cannot travel to {x}, {y}.')
+        else:
+            steps = self.travel_planner.tile_path(self.local_map, self.current_cell, (self.player_x, self.player_y), (x, y))
+            if steps is None:
+                self.events.append(f'No way to {x}, {y}.')
+            elif self.walk(steps, self.enemies_in_view()):
+                self.events.append(f'You arrive at {x}, {y}.')
+        self.damage.invalidate()
+
+    def travel_to_cell(self, target):
+        # Follow a coarse route over world cells, crossing each cell on a fine
+        # path between the portals of the sides it is entered and left by. A
+        # cell whose far edge cannot be reached is routed around.
+        self.events.append(f'Travelling to region {target[0]}, {target[1]}.')
+        watched = self.enemies_in_view()
+        blocked = set()  # (from, to) world cell crossings with no path
+        route = None
+        entry_side = None  # Side of the current cell the player came in by
+        while self.current_cell != target:
+            if route is None or self.current_cell not in route:
+                route = self.travel_planner.plan_route(self.current_cell, target, blocked)
+                self.world_map.keep_around(self.current_cell)
+                if route is None:
+                    self.events.append('No route found.')
+                    return
+            next_cell = route[route.index(self.current_cell) + 1]
+            side = (next_cell[0] - self.current_cell[0], next_cell[1] - self.current_cell[1])
+            steps = self.travel_planner.crossing_path(self.local_map, self.current_cell, (self.player_x, self.player_y),
+                                                      entry_side, side)
+            if steps is None:
+                blocked.add((self.current_cell, next_cell))
+                route = None
+                continue
+            if not self.walk(steps, watched):
+                return
+            entry_side = (-side[0], -side[1])
+            self.draw()
+        self.events.append(f'You arrive in {self.local_map_biome}.')
+
+    def walk(self, steps, watched):
+        # Take each step as a turn, redrawing every TRAVEL_DRAW_INTERVAL turns.
+        # Returns False once the walk is interrupted.
+        for number, (dx, dy) in enumerate(steps):
+            cell = self.current_cell
+            expected = (self.player_x + dx, self.player_y + dy)
+            self.move_player(dx, dy)
+            self.end_turn()
+            if self.travel_interrupted(watched):
+                return False
+            if self.current_cell == cell and (self.player_x, self.player_y) != expected:
+                self.events.append('The way is blocked.')
+                return False
+            if number % TRAVEL_DRAW_INTERVAL == TRAVEL_DRAW_INTERVAL - 1:
+                self.draw()
+        return True
+
+    def enemies_in_view(self):
+        fov = self.update_fov()
+        return {entity for entity in self.entity_grid().near(self.player_x, self.player_y, FOV_RADIUS)
+                if isinstance(entity, Enemy) and fov.can_see(entity.x, entity.y)}
+
+    def travel_interrupted(self, watched):
+        # Travel stops for a key press, leaving the open (combat, a dungeon)
+        # or an enemy coming into view that was not already in view
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                self.running = False
+            elif event.type == pygame.KEYDOWN:
+                self.events.append('You stop travelling.')
+                return True
+        if not self.running or self.state != 'local_map':
+            return True
+        for enemy in self.enemies_in_view() - watched:
+            self.events.append(f'A {enemy.name} comes into view.')
+            return True
+        return False
+
     def display_region_info(self):
         cell_x, cell_y = self.current_cell
-        cell_data = self.world_map[cell_y][cell_x]
+        cell_data = self.world_map.cell(cell_x, cell_y)
         biome = cell_data.get('biome', 'Unknown')
         has_town = cell_data.get('town', False)
         dungeons = cell_data.get('dungeons', [])
@@ -517,7 +662,7 @@ class Game:
         if event.key == pygame.K_RETURN and self.state == 'world_map':
             # Player selects the cell to spawn at
             cell_x, cell_y = self.selected_cell
-            cell_data = self.world_map[cell_y][cell_x]
+            cell_data = self.world_map.cell(cell_x, cell_y)
             if cell_data['biome'] == 'WATER':
                 self.events.append('Cannot spawn in water. Please select another cell.')
             else:
@@ -525,14 +670,17 @@ class Game:
                 self.current_cell = self.selected_cell
                 self.state = 'local_map'
                 self.events.append(f'Spawned in {self.local_map_biome}')
-        elif event.key == pygame.K_w and self.selected_cell[1] > 0:
+                self.start_autosave()
+        elif event.key == pygame.K_w:
             self.selected_cell = (self.selected_cell[0], self.selected_cell[1] - 1)
-        elif event.key == pygame.K_s and self.selected_cell[1] < WORLD_MAP_HEIGHT - 1:
+        elif event.key == pygame.K_s:
             self.selected_cell = (self.selected_cell[0], self.selected_cell[1] + 1)
-        elif event.key == pygame.K_a and self.selected_cell[0] > 0:
+        elif event.key == pygame.K_a:
             self.selected_cell = (self.selected_cell[0] - 1, self.selected_cell[1])
-        elif event.key == pygame.K_d and self.selected_cell[0] < WORLD_MAP_WIDTH - 1:
+        elif event.key == pygame.K_d:
             self.selected_cell = (self.selected_cell[0] + 1, self.selected_cell[1])
+        # Only the chunks around the cell being looked at stay loaded
+        self.world_map.keep_around(self.selected_cell)
 
     def handle_local_map_events(self, event, keys):
         if event.key == pygame.K_e:
@@ -571,8 +719,8 @@ class Game:
                 self.move_player_dungeon(dx, dy)
             else:
                 self.move_player(dx, dy)
-            # Move entities after player moves
-            self.move_entities()
+            # Move entities and advance time after player moves
+            self.end_turn()
 
 
     
@@ -580,14 +728,14 @@ class Game:
         new_x = self.player_x + dx
         new_y = self.player_y + dy
 
-        if 0 <= new_x < len(self.local_map[0]) and 0 <= new_y < len(self.local_map):
-            tile_type = self.local_map[new_y][new_x]
-            tile = TILES.get(tile_type, TILES['FLOOR'])
+        if self.local_map.in_bounds(new_x, new_y):
+            tile_id = self.local_map.get(new_x, new_y)
+            tile_type = TILE_TYPES[tile_id]
 
-            if tile['walkable']:
+            if TILE_WALKABLE[tile_id]:
                 self.player_x = new_x
                 self.player_y = new_y
-                self.events.append(f'Moved to {tile["name"]}')
+                self.events.append(f'Moved to {TILE_NAMES[tile_id]}')
 
                 if tile_type == 'STAIRS_DOWN':
                     self.dungeon_level += 1
@@ -606,7 +754,7 @@ class Game:
                 elif tile_type == 'CHEST':
                     self.open_chest(new_x, new_y)
             else:
-                self.events.append(f'Cannot walk into {tile["name"]}')
+                self.events.append(f'Cannot walk into {TILE_NAMES[tile_id]}')
 
 
     def open_chest(self, x, y):
@@ -620,58 +768,83 @@ class Game:
             item = random.choice(ITEMS)
             self.inventory.append(item)
             self.events.append(f'You found a {item} in the chest!')
+            journal = self.active_journal()
+            if journal is not None:
+                journal.inventory(self)
 
         # Remove the chest from the map
-        self.local_map[y][x] = 'FLOOR'
-
-    def connect_rooms(self, dungeon_map, room1, room2):
-        # Get the center coordinates of both rooms
-        x1, y1 = room1.center_x(), room1.center_y()
-        x2, y2 = room2.center_x(), room2.center_y()
-
-        # Randomly decide whether to go horizontal first or vertical
-        if random.choice([True, False]):
-            # Horizontal then vertical
-            self.create_h_tunnel(dungeon_map, x1, x2, y1)
-            self.create_v_tunnel(dungeon_map, y1, y2, x2)
-        else:
-            # Vertical then horizontal
-            self.create_v_tunnel(dungeon_map, y1, y2, x1)
-            self.create_h_tunnel(dungeon_map, x1, x2, y2)
+        self.set_tile(x, y, 'FLOOR')
 
+    def set_tile(self, x, y, tile_type):
+        # Mutate the current map after generation; keeps its terrain layer in sync
+        self.local_map.change(x, y, TILE_IDS[tile_type])
+        self.terrain_cache.mark_dirty(self.local_map, x, y)
+        self.fov.invalidate()
+        journal = self.active_journal()
+        if journal is not None:
+            journal.tile(self, x, y, TILE_IDS[tile_type])
 
     def exit_dungeon(self):
         self.events.append('You have exited the dungeon.')
         self.state = 'local_map'
+        self.dungeon_key = None
         # Restore player's position to the dungeon entrance on the local map
         self.player_x, self.player_y = self.dungeon_entrance_position
         # Restore the local map and other necessary variables
-        self.local_map = self.world_cells[self.current_cell]['local_map']
-        self.enemies = self.world_cells[self.current_cell]['enemies']
-        self.villagers = self.world_cells[self.current_cell]['villagers']
-
-
-    def spawn_dungeon_enemies(self):
-        num_enemies = random.randint(5, 10)
+        cell_data = self.world_cells[self.current_cell]
+        self.local_map = self.load_cell_map(self.current_cell)
+        self.enemies = cell_data['enemies']
+        self.villagers = cell_data['villagers']
+        self.catch_up_cell(self.current_cell, cell_data)
+
+
+    def spawn_dungeon_enemies(self, rng):
+        num_enemies = rng.randint(5, 10)
+        # The open tiles of a dungeon level are its floor
+        tile_index = self.local_map.index()
+        taken = self.occupied_positions()
         for _ in range(num_enemies):
-            while True:
-                x = random.randint(0, LOCAL_MAP_WIDTH - 1)
-                y = random.randint(0, LOCAL_MAP_HEIGHT - 1)
-                if self.local_map[y][x] == 'FLOOR' and (x != self.player_x or y != self.player_y):
-                    enemy_type = random.choice(['Goblin', 'Snake', 'Bat'])
-                    self.enemies.append(Enemy(x, y, enemy_type))
-                    break
-
+            position = tile_index.random_open(rng, taken)
+            if position is not None:
+                taken.add(position)
+                enemy_type = rng.choice(['Goblin', 'Snake', 'Bat'])
+                self.enemies.append(Enemy(*position, enemy_type, rng))
+
+
+    def entity_grid(self):
+        # The occupancy grid of the map in play. Rebuilt when the entity lists
+        # are replaced, as on entering another map or loading, or were added
+        # to directly, as by spawning; moves and removals go through the grid.
+        grid = self.occupancy
+        if (grid is None or grid.enemies is not self.enemies or grid.villagers is not self.villagers
+                or len(grid) != len(self.enemies) + len(self.villagers)):
+            grid = self.occupancy = EntityGrid(self.enemies, self.villagers)
+        return grid
+
+    def update_fov(self):
+        # The player's field of view on the map in play, recomputed only when
+        # they moved, the map was replaced or one of its tiles changed
+        self.fov.update(self.local_map, self.player_x, self.player_y)
+        return self.fov
 
     def move_entities(self):
         time_of_day = self.get_time_of_day()
+        grid = self.entity_grid()
+        fov = self.update_fov()
+        # One flow field toward the player serves every pursuing enemy; it is
+        # only built when one can see the player
+        flow_field = {}
+        for entity in grid.near(self.player_x, self.player_y, ENEMY_AGGRO_RADIUS):
+            if getattr(entity, 'behavior', None) == 'aggressive' and fov.can_see(entity.x, entity.y):
+                flow_field = self.local_map.distances_from(self.player_x, self.player_y, ENEMY_AGGRO_RADIUS)
+                break
         for enemy in self.enemies:
-            enemy.move(self.player_x, self.player_y, self.local_map, time_of_day)
+            enemy.move(self.player_x, self.player_y, self.local_map, time_of_day, grid, flow_field, fov)
             # Check if enemy has caught the player
             if enemy.x == self.player_x and enemy.y == self.player_y:
                 self.start_combat(enemy)
         for villager in self.villagers:
-            villager.move(self.local_map)
+            villager.move(self.local_map, grid)
             # Check if player is interacting with villager
             if villager.x == self.player_x and villager.y == self.player_y:
                 self.trade_with_villager(villager)
@@ -698,12 +871,13 @@ class Game:
             self.leave_region(0, 1)
             return
 
-        tile_type = self.local_map[new_y][new_x]
-        tile = TILES.get(tile_type, TILES['PLAIN'])
+        tile_id = self.local_map.get(new_x, new_y)
+        tile_type = TILE_TYPES[tile_id]
 
-        if tile['walkable']:
+        if TILE_WALKABLE[tile_id]:
             self.player_x = new_x
             self.player_y = new_y
+            self.prefetch_neighbors()
             #self.events.append(f'Moved to {tile["name"]}')-------------------------Debug
 
             # Handle interactions with special tiles
@@ -713,139 +887,46 @@ class Game:
                 self.enter_building()
             # Handle interactions with enemies, items, etc.
         else:
-            self.events.append(f'Cannot walk into {tile["name"]}')
+            self.events.append(f'Cannot walk into {TILE_NAMES[tile_id]}')
 
     def enter_dungeon(self):
         self.events.append('You enter the dungeon.')
         self.dungeon_level = 1
-        self.max_dungeon_level = random.randint(2, 5)
-        self.dungeon_maps = {}
         # Save the player's position before entering the dungeon
         self.dungeon_entrance_position = (self.player_x, self.player_y)
+        self.save_current_cell_state()  # The cell is caught up from here when the player comes back
+        self.prefetcher.prefetch([])  # Neighbouring cells are not needed underground
+        self.dungeon_prefetcher.prefetch([(self.current_cell, self.dungeon_entrance_position)])
+        self.max_dungeon_level = worldgen.dungeon_depth(self.world_seed, self.current_cell, self.dungeon_entrance_position)
         self.generate_dungeon_level(self.dungeon_level)
         self.state = 'dungeon'
 
     def generate_dungeon_level(self, level):
-        if level in self.dungeon_maps:
-            # Load existing level
-            dungeon_data = self.dungeon_maps[level]
-            self.local_map = dungeon_data['map']
-            self.player_x = dungeon_data['player_x']
-            self.player_y = dungeon_data['player_y']
+        # Dungeon levels are rebuilt from the seed of their cell, entrance and
+        # level, normally by the dungeon prefetcher before they are reached
+        cell, entrance = self.current_cell, self.dungeon_entrance_position
+        prepared = self.dungeon_prefetcher.take(cell, entrance, level)
+        if prepared is None:
+            prepared = worldgen.generate_dungeon_level(self.world_seed, cell, entrance, level, self.max_dungeon_level)
+        self.local_map, arrival = prepared
+        # The player arrives at the entrance on the first level, at stairs up below it
+        self.player_x, self.player_y = arrival
+        level_key = (cell, entrance, level)
+        self.dungeon_key = level_key
+        if level_key in self.dungeon_levels:
+            # Replay the changes made on earlier visits
+            dungeon_data = self.dungeon_levels[level_key]
+            self.local_map.apply_changes(dungeon_data['tiles'])
+            self.local_map.explored = dungeon_data['explored']
             self.enemies = dungeon_data['enemies']
         else:
-            # Generate new dungeon level
-            self.local_map = self.create_dungeon_map()
-            self.player_x, self.player_y = self.find_start_position()
             self.enemies = []
-            self.spawn_dungeon_enemies()
-
-            # Place stairs if not last level
-            if level < self.max_dungeon_level:
-                self.place_stairs()
-            else:
-                # Optionally, place an exit or boss here
-                pass
-
-            # Save the dungeon level
-            self.dungeon_maps[level] = {
-                'map': self.local_map,
-                'player_x': self.player_x,
-                'player_y': self.player_y,
+            self.spawn_dungeon_enemies(worldgen.dungeon_rng(self.world_seed, cell, entrance, level, 'spawns'))
+            self.dungeon_levels[level_key] = {
+                'tiles': self.local_map.changes,
                 'enemies': self.enemies,
+                'explored': self.local_map.explored,
             }
-        if level > 1:
-            # Place stairs up on levels beyond the first
-            stair_up_x, stair_up_y = self.place_feature_in_random_room('STAIRS_UP')
-            # Set player position at stairs up
-            self.player_x, self.player_y = stair_up_x, stair_up_y
-        else:
-            # For the first level, set player position at entrance
-            self.player_x, self.player_y = self.place_feature_in_random_room('ENTRANCE')
-            # Optionally, mark this tile differently if needed
-
-    def create_dungeon_map(self):
-        dungeon_map = [['WALL' for _ in range(LOCAL_MAP_WIDTH)] for _ in range(LOCAL_MAP_HEIGHT)]
-        self.rooms = []  # Keep track of rooms
-        max_rooms = 10
-        room_min_size = 6
-        room_max_size = 12
-
-        for _ in range(max_rooms):
-            w = random.randint(room_min_size, room_max_size)
-            h = random.randint(room_min_size, room_max_size)
-            x = random.randint(1, LOCAL_MAP_WIDTH - w - 1)
-            y = random.randint(1, LOCAL_MAP_HEIGHT - h - 1)
-            new_room = Rect(x, y, w, h)
-
-            # Check for overlaps
-            failed = False
-            for other_room in self.rooms:
-                if new_room.intersect(other_room):
-                    failed = True
-                    break
-            if not failed:
-                # Create room
-                self.create_room(dungeon_map, new_room)
-                self.rooms.append(new_room)
-
-                # Connect to previous room
-                if len(self.rooms) > 1:
-                    prev_room = self.rooms[-2]
-                    self.connect_rooms(dungeon_map, prev_room, new_room)
-        self.place_chests()
-
-        return dungeon_map
-
-    def place_chests(self):
-        num_chests = random.randint(1, len(self.rooms) // 2)  # Up to half the rooms
-        chest_rooms = random.sample(self.rooms, num_chests)
-        for room in chest_rooms:
-            x = random.randint(room.x1 + 1, room.x2 - 1)
-            y = random.randint(room.y1 + 1, room.y2 - 1)
-            if self.local_map[y][x] == 'FLOOR':
-                self.local_map[y][x] = 'CHEST'
-
-    def create_room(self, dungeon_map, room):
-        for x in range(room.x1 + 1, room.x2):
-            for y in range(room.y1 + 1, room.y2):
-                dungeon_map[y][x] = 'FLOOR'
-
-    def create_h_tunnel(self, dungeon_map, x1, x2, y):
-        for x in range(min(x1, x2), max(x1, x2) + 1):
-            dungeon_map[y][x] = 'FLOOR'
-
-    def create_v_tunnel(self, dungeon_map, y1, y2, x):
-        for y in range(min(y1, y2), max(y1, y2) + 1):
-            dungeon_map[y][x] = 'FLOOR'
-
-    def find_start_position(self):
-        # Find the position of the entrance tile
-        for y in range(LOCAL_MAP_HEIGHT):
-            for x in range(LOCAL_MAP_WIDTH):
-                if self.local_map[y][x] == 'ENTRANCE':
-                    return x, y
-        # Fallback to any floor tile
-        for y in range(LOCAL_MAP_HEIGHT):
-            for x in range(LOCAL_MAP_WIDTH):
-                if self.local_map[y][x] == 'FLOOR':
-                    return x, y
-        # Default to center
-        return LOCAL_MAP_WIDTH // 2, LOCAL_MAP_HEIGHT // 2
-
-    def place_stairs(self):
-        # Place stairs down in a random room
-        stair_down_x, stair_down_y = self.place_feature_in_random_room('STAIRS_DOWN')
-        # Optionally, place stairs up if needed
-        if self.dungeon_level > 1:
-            stair_up_x, stair_up_y = self.place_feature_in_random_room('STAIRS_UP')
-
-    def place_feature_in_random_room(self, feature):
-        room = random.choice(self.rooms)
-        x = random.randint(room.x1 + 1, room.x2 - 1)
-        y = random.randint(room.y1 + 1, room.y2 - 1)
-        self.local_map[y][x] = feature
-        return x, y
 
     def leave_region(self, dx, dy):
         # Determine new cell coordinates
@@ -865,19 +946,17 @@ class Game:
         else:
             entrance_direction = None
 
-        # Check if the new cell is within the world map bounds
-        if 0 <= new_cell_x < WORLD_MAP_WIDTH and 0 <= new_cell_y < WORLD_MAP_HEIGHT:
-            # Before leaving, save the current cell's state
-            self.save_current_cell_state()
+        # Before leaving, save the current cell's state
+        self.save_current_cell_state()
 
-            # Update current cell
-            self.current_cell = (new_cell_x, new_cell_y)
+        # Update current cell; the world has no edges, only chunks near it stay loaded
+        self.current_cell = (new_cell_x, new_cell_y)
+        self.world_map.keep_around(self.current_cell)
 
-            # Generate or load the local map for the new cell
-            self.local_map = self.generate_local_map(new_cell_x, new_cell_y, entrance_direction)
-            self.events.append(f'Entered new region: {self.local_map_biome}')
-        else:
-            self.events.append('Cannot leave the world boundaries')
+        # Generate or load the local map for the new cell
+        self.local_map = self.generate_local_map(new_cell_x, new_cell_y, entrance_direction)
+        self.events.append(f'Entered new region: {self.local_map_biome}')
+        self.prefetch_neighbors()
 
     def start_combat(self, enemy):
         self.state = 'combat'
@@ -889,12 +968,14 @@ class Game:
         # Save the state of the current cell
         cell_key = self.current_cell
         self.world_cells[cell_key] = {
-            'local_map': self.local_map,
+            'tiles': self.local_map.changes,
             'player_x': self.player_x,
             'player_y': self.player_y,
             'enemies': self.enemies,
             'villagers': self.villagers,
             'biome': self.local_map_biome,
+            'explored': self.local_map.explored,
+            'simulated_turn': self.turn,
         }
 
     def combat_loop(self):
@@ -914,10 +995,15 @@ class Game:
                 self.events.append(f'You defeated the {self.current_enemy.name}!')
                 self.xp += self.current_enemy.xp
                 self.gold += self.current_enemy.gold
+                self.entity_grid().remove(self.current_enemy)
                 self.enemies.remove(self.current_enemy)
                 self.state = 'local_map'
                 self.in_combat = False
                 self.current_enemy = None
+                journal = self.active_journal()
+                if journal is not None:
+                    journal.player(self)
+                    journal.entities(self)
                 combat_active = False
                 break
 
@@ -936,19 +1022,21 @@ class Game:
                 self.events.append('You have been defeated!')
                 self.running = False  # End the game
                 combat_active = False
+        self.combat_scene = None
 
     def attack_phase(self):
         # Attack mechanic with moving bar
-        bar_width = 300
-        bar_height = 20
-        bar_x = (WINDOW_WIDTH - bar_width) // 2
-        bar_y = WINDOW_HEIGHT // 2 - 100
-        indicator_width = 10
-
-        indicator_x = bar_x
-        indicator_speed = 5  # Pixels per frame
+        bar = ATTACK_BAR
+        indicator_width = INDICATOR_WIDTH
+        indicator_speed = 300  # Pixels per second
+        indicator_x = bar.x
         moving_right = True
 
+        # The screen is drawn once; each frame only repaints the bar
+        self.draw_attack_phase(indicator_x)
+        pygame.display.flip()
+        self.clock.tick(FPS)
+
         attacking = True
         damage = 0
         while attacking and self.running:
@@ -959,42 +1047,69 @@ class Game:
                 elif event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_SPACE:
                         # Calculate damage based on indicator position
-                        center_x = bar_x + bar_width // 2
-                        distance_from_center = abs((indicator_x + indicator_width // 2) - center_x)
-                        max_distance = bar_width // 2
+                        distance_from_center = abs((int(indicator_x) + indicator_width // 2) - bar.centerx)
+                        max_distance = bar.width // 2
                         damage_multiplier = 1 - (distance_from_center / max_distance)
                         damage = int((self.attack + random.randint(0, 5)) * damage_multiplier)
                         attacking = False
                         break
+            if not attacking:
+                break
 
-            # Move indicator
+            # Move indicator by elapsed time so its speed does not depend on frame rate
+            step = indicator_speed * self.clock.tick(FPS) / 1000
             if moving_right:
-                indicator_x += indicator_speed
-                if indicator_x + indicator_width >= bar_x + bar_width:
-                    indicator_x = bar_x + bar_width - indicator_width
+                indicator_x += step
+                if indicator_x + indicator_width >= bar.right:
+                    indicator_x = bar.right - indicator_width
                     moving_right = False
             else:
-                indicator_x -= indicator_speed
-                if indicator_x <= bar_x:
-                    indicator_x = bar_x
+                indicator_x -= step
+                if indicator_x <= bar.x:
+                    indicator_x = bar.x
                     moving_right = True
 
-            # Draw attack bar
-            self.screen.fill(BLACK)
-            self.draw_text(self.screen, f'Combat with {self.current_enemy.name}', 50, 20, RED)
-            self.draw_text(self.screen, f'Your HP: {self.health}/{self.max_health}', 50, 50, WHITE)
-            self.draw_text(self.screen, f'{self.current_enemy.name} HP: {self.current_enemy.health}/{self.current_enemy.max_health}', 50, 70, WHITE)
-            self.draw_text(self.screen, 'Attack Phase: Press SPACE when the indicator is at the center!', 50, bar_y - 40, WHITE)
-            pygame.draw.rect(self.screen, WHITE, (bar_x, bar_y, bar_width, bar_height), 2)
-            # Center marker
-            pygame.draw.line(self.screen, RED, (bar_x + bar_width // 2, bar_y), (bar_x + bar_width // 2, bar_y + bar_height), 2)
-            # Indicator
-            pygame.draw.rect(self.screen, GREEN, (indicator_x, bar_y, indicator_width, bar_height))
-            pygame.display.flip()
-            self.clock.tick(FPS)
+            pygame.display.update(self.draw_attack_indicator(int(indicator_x)))
 
         return damage
 
+    def get_combat_scene(self):
+        # Static parts of both combat screens, built once per encounter
+        enemy = self.current_enemy
+        if self.combat_scene is None or self.combat_scene['enemy'] is not enemy:
+            background = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT))
+            background.fill(BLACK)
+            self.draw_text(background, f'Combat with {enemy.name}', 50, 20, RED)
+
+            attack = background.copy()
+            self.draw_text(attack, 'Attack Phase: Press SPACE when the indicator is at the center!', 50, ATTACK_BAR.y - 40, WHITE)
+            pygame.draw.rect(attack, WHITE, ATTACK_BAR, 2)
+            # Center marker
+            pygame.draw.line(attack, RED, (ATTACK_BAR.centerx, ATTACK_BAR.y), (ATTACK_BAR.centerx, ATTACK_BAR.bottom), 2)
+
+            defense = background.copy()
+            self.draw_text(defense, 'Defense Phase: Press the arrows in sequence!', 50, WINDOW_HEIGHT // 2 - 100, WHITE)
+
+            self.combat_scene = {'enemy': enemy, 'attack': attack, 'defense': defense}
+        return self.combat_scene
+
+    def draw_combat_header(self, background):
+        # Hit points only change between phases, so they are drawn once per phase
+        self.screen.blit(background, (0, 0))
+        self.draw_text(self.screen, f'Your HP: {self.health}/{self.max_health}', 50, 50, WHITE)
+        self.draw_text(self.screen, f'{self.current_enemy.name} HP: {self.current_enemy.health}/{self.current_enemy.max_health}', 50, 70, WHITE)
+
+    def draw_attack_phase(self, indicator_x):
+        self.draw_combat_header(self.get_combat_scene()['attack'])
+        self.draw_attack_indicator(indicator_x)
+
+    def draw_attack_indicator(self, indicator_x):
+        # Restore the bar from the background, draw the indicator and return the changed area
+        area = ATTACK_BAR.inflate(4, 4)
+        self.screen.blit(self.get_combat_scene()['attack'], area, area)
+        pygame.draw.rect(self.screen, GREEN, (indicator_x, ATTACK_BAR.y, INDICATOR_WIDTH, ATTACK_BAR.height))
+        return area
+
     def defense_phase(self):
         # Defense mechanic with rhythm game
         sequence_length = 5
@@ -1003,66 +1118,69 @@ class Game:
         for _ in range(sequence_length):
             arrows.append(random.choice(arrow_keys))
 
-        arrow_images = {
-            pygame.K_UP: pygame.transform.scale(self.font.render('↑', True, WHITE), (50, 50)),
-            pygame.K_DOWN: pygame.transform.scale(self.font.render('↓', True, WHITE), (50, 50)),
-            pygame.K_LEFT: pygame.transform.scale(self.font.render('←', True, WHITE), (50, 50)),
-            pygame.K_RIGHT: pygame.transform.scale(self.font.render('→', True, WHITE), (50, 50)),
-        }
-
         current_arrow = 0
-        input_time = 1.5  # Time in seconds to input each arrow
-        last_time = time.time()
-        defending = True
+        input_time = 1500  # Time in milliseconds to input each arrow
         damage_taken = 0
 
-        while defending and self.running:
-            current_time = time.time()
-            if current_time - last_time > input_time:
+        self.draw_defense_phase(arrows, current_arrow)
+        pygame.display.flip()
+
+        # Each arrow gets a one-shot timer; the event carries the arrow index so
+        # a timeout that was already queued when the player answered is ignored
+        pygame.time.set_timer(pygame.event.Event(DEFENSE_TIMEOUT, arrow=current_arrow), input_time, loops=1)
+        while current_arrow < sequence_length and self.running:
+            event = pygame.event.wait()
+            if event.type == pygame.QUIT:
+                pygame.time.set_timer(DEFENSE_TIMEOUT, 0)
+                self.running = False
+                return None
+            elif event.type == DEFENSE_TIMEOUT:
+                if event.arrow != current_arrow:
+                    continue
                 # Player failed to input in time
                 damage_taken += self.current_enemy.attack // sequence_length
-                current_arrow += 1
-                last_time = current_time
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.running = False
-                    return None
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == arrows[current_arrow]:
-                        # Correct key pressed
-                        current_arrow += 1
-                        last_time = current_time
-                    else:
-                        # Wrong key pressed
-                        damage_taken += self.current_enemy.attack // sequence_length
-                        current_arrow += 1
-                        last_time = current_time
-
-            if current_arrow >= sequence_length:
-                defending = False
+            elif event.type == pygame.KEYDOWN:
+                if event.key != arrows[current_arrow]:
+                    # Wrong key pressed
+                    damage_taken += self.current_enemy.attack // sequence_length
+            else:
+                continue
 
-            # Draw defense screen
-            self.screen.fill(BLACK)
-            self.draw_text(self.screen, f'Combat with {self.current_enemy.name}', 50, 20, RED)
-            self.draw_text(self.screen, f'Your HP: {self.health}/{self.max_health}', 50, 50, WHITE)
-            self.draw_text(self.screen, f'{self.current_enemy.name} HP: {self.current_enemy.health}/{self.current_enemy.max_health}', 50, 70, WHITE)
-            self.draw_text(self.screen, 'Defense Phase: Press the arrows in sequence!', 50, WINDOW_HEIGHT // 2 - 100, WHITE)
-            for i in range(sequence_length):
-                arrow = arrows[i]
-                x = WINDOW_WIDTH // 2 - (sequence_length * 30) + i * 60
-                y = WINDOW_HEIGHT // 2
-                if i < current_arrow:
-                    # Already passed
-                    arrow_img = arrow_images[arrow].copy()
-                    arrow_img.fill(DARK_GRAY, special_flags=pygame.BLEND_RGBA_MULT)
-                else:
-                    arrow_img = arrow_images[arrow]
-                self.screen.blit(arrow_img, (x, y))
-            pygame.display.flip()
-            self.clock.tick(FPS)
+            pygame.display.update(self.draw_defense_arrow(arrows, current_arrow, True))
+            current_arrow += 1
+            pygame.time.set_timer(pygame.event.Event(DEFENSE_TIMEOUT, arrow=current_arrow), input_time, loops=1)
+        pygame.time.set_timer(DEFENSE_TIMEOUT, 0)
 
         return damage_taken
 
+    def draw_defense_phase(self, arrows, current_arrow):
+        self.draw_combat_header(self.get_combat_scene()['defense'])
+        for i in range(len(arrows)):
+            # Arrows already passed are dimmed
+            self.draw_defense_arrow(arrows, i, i < current_arrow)
+
+    def draw_defense_arrow(self, arrows, index, passed):
+        # Draw one arrow slot over the background and return the changed area
+        normal, dimmed = self.get_arrow_images()[arrows[index]]
+        arrow_img = dimmed if passed else normal
+        x = WINDOW_WIDTH // 2 - (len(arrows) * 30) + index * 60
+        y = WINDOW_HEIGHT // 2
+        area = arrow_img.get_rect(topleft=(x, y))
+        self.screen.blit(self.get_combat_scene()['defense'], area, area)
+        self.screen.blit(arrow_img, area)
+        return area
+
+    def get_arrow_images(self):
+        # Scaled arrow glyphs for the defense phase, normal and dimmed, built on first use
+        if self.arrow_images is None:
+            self.arrow_images = {}
+            for key, char in ((pygame.K_UP, '↑'), (pygame.K_DOWN, '↓'), (pygame.K_LEFT, '←'), (pygame.K_RIGHT, '→')):
+                normal = pygame.transform.scale(render_text(char, WHITE), (50, 50))
+                dimmed = normal.copy()
+                dimmed.fill(DARK_GRAY, special_flags=pygame.BLEND_RGBA_MULT)
+                self.arrow_images[key] = (normal, dimmed)
+        return self.arrow_images
+
     def open_inventory(self):
         # Display inventory screen
         inventory_active = True
@@ -1085,24 +1203,18 @@ class Game:
                 elif event.type == pygame.QUIT:
                     self.running = False
                     inventory_active = False
+        self.damage.invalidate()
 
     def examine_tile(self, x, y):
-        if 0 <= x < len(self.local_map[0]) and 0 <= y < len(self.local_map):
-            tile_type = self.local_map[y][x]
-            tile = TILES.get(tile_type, TILES['PLAIN'])
-            # Check for enemy at the location
-            for enemy in self.enemies:
-                if enemy.x == x and enemy.y == y:
-                    self.message = f'You see a {enemy.name}'
-                    self.events.append(self.message)
-                    return
-            # Check for villager at the location
-            for villager in self.villagers:
-                if villager.x == x and villager.y == y:
-                    self.message = f'You see a {villager.name}'
-                    self.events.append(self.message)
-                    return
-            self.message = f'You see a {tile["name"]}'
+        if self.local_map.in_bounds(x, y):
+            tile_id = self.local_map.get(x, y)
+            # Check for an enemy or villager at the location
+            entity = self.entity_grid().at(x, y)
+            if entity is not None:
+                self.message = f'You see a {entity.name}'
+                self.events.append(self.message)
+                return
+            self.message = f'You see a {TILE_NAMES[tile_id]}'
             self.events.append(self.message)
         else:
             self.message = 'Nothing of interest'
@@ -1122,15 +1234,10 @@ class Game:
 
         # Generate small interior map
         interior_map_size = 20  # Small interior map size
-        self.local_map = [[None for _ in range(interior_map_size)] for _ in range(interior_map_size)]
-        for y in range(interior_map_size):
-            for x in range(interior_map_size):
-                if y == 0 or y == interior_map_size -1 or x == 0 or x == interior_map_size -1:
-                    self.local_map[y][x] = 'HOUSE_WALL'
-                else:
-                    self.local_map[y][x] = 'HOUSE_FLOOR'
+        self.local_map = TileMap(interior_map_size, interior_map_size, 'HOUSE_WALL')
+        self.local_map.fill_rect(1, 1, interior_map_size - 2, interior_map_size - 2, TILE_IDS['HOUSE_FLOOR'])
         # Place door to exit
-        self.local_map[interior_map_size -1][interior_map_size // 2] = 'DOOR'  # Door at bottom center
+        self.local_map.set(interior_map_size // 2, interior_map_size -1, TILE_IDS['DOOR'])  # Door at bottom center
         # Set player's position to just inside the door
         self.player_x = interior_map_size // 2
         self.player_y = interior_map_size -2  # One tile above the door
@@ -1178,6 +1285,7 @@ class Game:
                 elif event.type == pygame.QUIT:
                     self.running = False
                     trading = False
+        self.damage.invalidate()
 
     def buy_item(self):
         # Simple item purchase logic
@@ -1206,6 +1314,10 @@ class Game:
                                 self.gold -= price
                                 self.inventory.append(item)
                                 self.events.append(f'Bought {item} for {price} gold.')
+                                journal = self.active_journal()
+                                if journal is not None:
+                                    journal.player(self)
+                                    journal.inventory(self)
                             else:
                                 self.events.append('Not enough gold.')
                             selecting = False
@@ -1214,81 +1326,133 @@ class Game:
                     selecting = False
 
     def draw_text(self, surface, text, x, y, color=WHITE):
-        text_surface = self.font.render(text, True, color)
-        surface.blit(text_surface, (x, y))
+        draw_text(surface, text, x, y, color)
 
     def draw(self):
         if self.state == 'combat':
             self.combat_loop()
-        elif self.state == 'main_menu':
-            self.draw_main_menu()
-        else:
+            # Combat draws its own screens, so the next frame starts from scratch
+            self.damage.invalidate()
+            return
+
+        scene = (self.state, self.hud_visible, self.command_mode)
+        if scene != self.scene:
+            self.scene = scene
+            self.damage.invalidate()
+        if self.damage.full:
             self.screen.fill(BLACK)
+
+        if self.state == 'main_menu':
+            if self.damage.full:
+                self.draw_main_menu()
+        elif self.command_mode and not self.damage.full:
+            # The scene behind the overlay is frozen while typing
+            self.draw_command_input()
+        else:
             if self.state == 'world_map' or self.state == 'map_mode':
                 self.draw_world_map()
-                if self.state == 'map_mode':
-                    # Indicate current cell
-                    x, y = self.current_cell
-                    rect = pygame.Rect(x * CELL_SIZE, y * CELL_SIZE, CELL_SIZE, CELL_SIZE)
-                    pygame.draw.rect(self.screen, YELLOW, rect, 2)
             elif self.state == 'local_map' or self.state == 'dungeon':
                 self.draw_local_map()
                 self.draw_panel()
             if self.command_mode:
                 self.draw_command_input()
-            pygame.display.flip()
+        self.damage.present()
 
     def draw_main_menu(self):
         self.screen.fill(BLACK)
-        title_font = pygame.font.SysFont(FONT_NAME, 72)
-        subtitle_font = pygame.font.SysFont(FONT_NAME, 36)
-        title_surface = title_font.render('Valdmir', True, WHITE)
-        subtitle_surface = subtitle_font.render('Press any key to start', True, WHITE)
+        title_surface = render_text('Valdmir', WHITE, 72)
+        if self.has_autosave():
+            lines = ['Press R to resume the autosaved game', 'or any other key to start a new one']
+        else:
+            lines = ['Press any key to start']
         title_rect = title_surface.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2 - 50))
-        subtitle_rect = subtitle_surface.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2 + 50))
         self.screen.blit(title_surface, title_rect)
-        self.screen.blit(subtitle_surface, subtitle_rect)
-        pygame.display.flip()
+        for number, line in enumerate(lines):
+            subtitle_surface = render_text(line, WHITE, 36)
+            subtitle_rect = subtitle_surface.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2 + 50 + 40 * number))
+            self.screen.blit(subtitle_surface, subtitle_rect)
 
     def draw_command_input(self):
-        # Draw semi-transparent overlay
-        overlay = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT))
-        overlay.set_alpha(128)
-        overlay.fill(BLACK)
-        self.screen.blit(overlay, (0, 0))
-        # Draw command input box
         input_box = pygame.Rect(50, WINDOW_HEIGHT // 2 - 20, WINDOW_WIDTH - 100, 40)
+        if self.damage.full:
+            # Draw semi-transparent overlay
+            overlay = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT))
+            overlay.set_alpha(128)
+            overlay.fill(BLACK)
+            self.screen.blit(overlay, (0, 0))
+            # Keep what is under the input box so typing only repaints the box
+            self.command_backdrop = self.screen.subsurface(input_box).copy()
+            prompt_text = render_text('Enter command:', WHITE)
+            self.screen.blit(prompt_text, (input_box.x, input_box.y - 30))
+        elif self.command_input == self.drawn_command:
+            return
+        else:
+            self.screen.blit(self.command_backdrop, input_box)
+            self.damage.add(input_box)
+        # Draw command input box
         pygame.draw.rect(self.screen, WHITE, input_box, 2)
-        command_text = self.font.render(self.command_input, True, WHITE)
+        command_text = render_text(self.command_input, WHITE)
+        self.screen.set_clip(input_box)
         self.screen.blit(command_text, (input_box.x + 10, input_box.y + 10))
-        prompt_text = self.font.render('Enter command:', True, WHITE)
-        self.screen.blit(prompt_text, (input_box.x, input_box.y - 30))
+        self.screen.set_clip(None)
+        self.drawn_command = self.command_input
+
+    def update_world_camera(self):
+        # Scroll the world map just enough to keep the selected cell above the instructions
+        visible_x = WINDOW_WIDTH // CELL_SIZE
+        visible_y = (WINDOW_HEIGHT - 60) // CELL_SIZE
+        camera_x, camera_y = self.world_camera
+        x, y = self.selected_cell
+        camera_x = max(min(camera_x, x), x - visible_x + 1)
+        camera_y = max(min(camera_y, y), y - visible_y + 1)
+        self.world_camera = (camera_x, camera_y)
+
+    def world_cell_rect(self, cell):
+        camera_x, camera_y = self.world_camera
+        return pygame.Rect((cell[0] - camera_x) * CELL_SIZE, (cell[1] - camera_y) * CELL_SIZE, CELL_SIZE, CELL_SIZE)
 
     def draw_world_map(self):
-        for y in range(WORLD_MAP_HEIGHT):
-            for x in range(WORLD_MAP_WIDTH):
-                cell_data = self.world_map[y][x]
-                biome = cell_data['biome']
-                color = BIOME_COLORS[biome]
-                rect = pygame.Rect(x * CELL_SIZE, y * CELL_SIZE, CELL_SIZE, CELL_SIZE)
-                pygame.draw.rect(self.screen, color, rect)
-                pygame.draw.rect(self.screen, BLACK, rect, 1)  # Cell border
-                if cell_data['town']:
-                    # Draw town marker
-                    pygame.draw.circle(self.screen, YELLOW, rect.center, CELL_SIZE // 4)
+        self.update_world_camera()
+        help_area = pygame.Rect(0, WINDOW_HEIGHT - 60, WINDOW_WIDTH, 60)
+        # Selected cell, plus the current cell in map mode
+        marks = (self.selected_cell, self.current_cell if self.state == 'map_mode' else None)
+        full = self.damage.full or self.world_camera != self.drawn_world_camera
+        if not full:
+            if marks == self.drawn_world_marks:
+                return
+            rects = [self.world_cell_rect(cell) for cell in self.drawn_world_marks + marks if cell is not None]
+            if help_area.collidelist(rects) != -1:
+                full = True
+            else:
+                # Erase the old highlights from the cached map; the new ones go on top
+                for cell in self.drawn_world_marks:
+                    if cell is not None:
+                        self.world_map_cache.draw_cell(self.screen, cell, self.world_cell_rect(cell))
+                for rect in rects:
+                    self.damage.add(rect)
+        if full:
+            screen_area = self.screen.get_rect()
+            self.screen.fill(BLACK, screen_area)
+            self.world_map_cache.draw(self.screen, self.world_camera, screen_area)
+            self.damage.add(screen_area)
+        self.drawn_world_marks = marks
+        self.drawn_world_camera = self.world_camera
 
         # Highlight selected cell
-        x, y = self.selected_cell
-        rect = pygame.Rect(x * CELL_SIZE, y * CELL_SIZE, CELL_SIZE, CELL_SIZE)
-        pygame.draw.rect(self.screen, WHITE, rect, 2)
+        pygame.draw.rect(self.screen, WHITE, self.world_cell_rect(self.selected_cell), 2)
 
-        # Instructions
-        if self.state == 'world_map':
-            self.draw_text(self.screen, 'Use WASD to select a starting location and press ENTER.', 10, WINDOW_HEIGHT - 60, WHITE)
-        else:
-            self.draw_text(self.screen, 'World Map (Press M to return)', 10, WINDOW_HEIGHT - 60, WHITE)
-        self.draw_text(self.screen, 'Biomes: Plains (green), Forest (dark green), Mountains (gray), Desert (tan), Water (blue)', 10, WINDOW_HEIGHT - 40, WHITE)
-        self.draw_text(self.screen, 'Towns are marked with yellow circles.', 10, WINDOW_HEIGHT - 20, WHITE)
+        if self.state == 'map_mode':
+            # Indicate current cell
+            pygame.draw.rect(self.screen, YELLOW, self.world_cell_rect(self.current_cell), 2)
+
+        if full:
+            # Instructions
+            if self.state == 'world_map':
+                self.draw_text(self.screen, 'Use WASD to select a starting location and press ENTER.', 10, WINDOW_HEIGHT - 60, WHITE)
+            else:
+                self.draw_text(self.screen, 'World Map (Press M to return)', 10, WINDOW_HEIGHT - 60, WHITE)
+            self.draw_text(self.screen, 'Biomes: Plains (green), Forest (dark green), Mountains (gray), Desert (tan), Water (blue)', 10, WINDOW_HEIGHT - 40, WHITE)
+            self.draw_text(self.screen, 'Towns are marked with yellow circles.', 10, WINDOW_HEIGHT - 20, WHITE)
 
     def draw_local_map(self):
         # Calculate the offset to keep the player centered
@@ -1299,95 +1463,189 @@ class Game:
         offset_y = self.player_y - half_viewport_height
 
         # Clamp the offset so we don't go out of bounds
-        offset_x = max(0, min(offset_x, len(self.local_map[0]) - VIEWPORT_WIDTH))
-        offset_y = max(0, min(offset_y, len(self.local_map) - VIEWPORT_HEIGHT))
-
-        for y in range(VIEWPORT_HEIGHT):
-            for x in range(VIEWPORT_WIDTH):
-                map_x = x + offset_x
-                map_y = y + offset_y
-
-                if 0 <= map_x < len(self.local_map[0]) and 0 <= map_y < len(self.local_map):
-                    tile_type = self.local_map[map_y][map_x]
-                    tile = TILES.get(tile_type, TILES['PLAIN'])
-                    char = tile['char']
-                    color = tile['color']
-
-                    draw_x = x * TILE_SIZE
-                    draw_y = y * TILE_SIZE
-
-                    self.draw_text(self.screen, char, draw_x, draw_y, color)
-
-        # Draw enemies
-        for enemy in self.enemies:
-            if offset_x <= enemy.x < offset_x + VIEWPORT_WIDTH and offset_y <= enemy.y < offset_y + VIEWPORT_HEIGHT:
-                draw_x = (enemy.x - offset_x) * TILE_SIZE
-                draw_y = (enemy.y - offset_y) * TILE_SIZE
-                self.draw_text(self.screen, enemy.char, draw_x, draw_y, enemy.color)
-
-        # Draw villagers
-        for villager in self.villagers:
-            if offset_x <= villager.x < offset_x + VIEWPORT_WIDTH and offset_y <= villager.y < offset_y + VIEWPORT_HEIGHT:
-                draw_x = (villager.x - offset_x) * TILE_SIZE
-                draw_y = (villager.y - offset_y) * TILE_SIZE
-                self.draw_text(self.screen, villager.char, draw_x, draw_y, villager.color)
+        offset_x = max(0, min(offset_x, self.local_map.width - VIEWPORT_WIDTH))
+        offset_y = max(0, min(offset_y, self.local_map.height - VIEWPORT_HEIGHT))
+
+        layer = self.terrain_cache.layer_for(self.local_map)
+        refreshed = layer.refresh()
+        viewport = pygame.Rect(0, 0, VIEWPORT_WIDTH * TILE_SIZE, VIEWPORT_HEIGHT * TILE_SIZE)
+        view = viewport.move(offset_x * TILE_SIZE, offset_y * TILE_SIZE)
+
+        atlas = self.glyph_atlas
+        batch = []
+
+        # Tiles out of view are fogged. When the view changed, the fog can only
+        # differ on screen inside the box bounding the old and the new view.
+        fov = self.update_fov()
+        fog_changes = []
+        if self.drawn_fov is not None and self.drawn_fov[0] != fov.revision:
+            fog_changes = [self.drawn_fov[1].union(fov.box)]
+        if self.fog_layer is None or self.fog_layer.local_map is not self.local_map:
+            self.fog_layer = FogLayer(self.local_map, self.fog_layer)
+        self.fog_layer.update(fov.visible)
+        fog = self.fog_layer.surface
+
+        # Draw the enemies and villagers in view
+        for entity in self.entity_grid().in_rect(offset_x, offset_y, VIEWPORT_WIDTH, VIEWPORT_HEIGHT):
+            if not fov.can_see(entity.x, entity.y):
+                continue
+            draw_x = (entity.x - offset_x) * TILE_SIZE
+            draw_y = (entity.y - offset_y) * TILE_SIZE
+            batch.append(atlas.blit_item(entity.char, entity.color, draw_x, draw_y))
 
         # Draw player at the center of the viewport
         player_draw_x = (self.player_x - offset_x) * TILE_SIZE
         player_draw_y = (self.player_y - offset_y) * TILE_SIZE
-        self.draw_text(self.screen, self.player_char, player_draw_x, player_draw_y, self.player_color)
+        batch.append(atlas.blit_item(self.player_char, self.player_color, player_draw_x, player_draw_y))
+
+        view_key = (id(self.local_map), offset_x, offset_y)
+        self.screen.set_clip(viewport)
+        scroll_x = scroll_y = None
+        if not self.damage.full and self.drawn_view is not None and view_key[0] == self.drawn_view[0]:
+            scroll_x = offset_x - self.drawn_view[1]
+            scroll_y = offset_y - self.drawn_view[2]
+        if scroll_x is None or abs(scroll_x) >= VIEWPORT_WIDTH or abs(scroll_y) >= VIEWPORT_HEIGHT:
+            # Terrain is a single sub-rectangle blit from the map's cached layer
+            self.screen.fill(BLACK, viewport)
+            self.screen.blit(layer.surface, (0, 0), view)
+            self.screen.blit(fog, (0, 0), view, special_flags=pygame.BLEND_MULT)
+            self.screen.blits(batch, doreturn=False)
+            self.damage.add(viewport)
+        elif scroll_x or scroll_y:
+            # The camera moved with the player: erase the old entities and any
+            # re-rendered terrain, scroll what is already on screen and render
+            # only the newly exposed rows or columns from the terrain layer
+            old_view = view.move(-scroll_x * TILE_SIZE, -scroll_y * TILE_SIZE)
+            regions = [region.move(-old_view.x, -old_view.y) for region in refreshed]
+            regions += [self.glyph_rect(item) for item in self.drawn_entities]
+            for region in regions:
+                self.screen.fill(BLACK, region)
+                self.screen.blit(layer.surface, region, region.move(old_view.x, old_view.y))
+                self.screen.blit(fog, region, region.move(old_view.x, old_view.y), special_flags=pygame.BLEND_MULT)
+            self.screen.scroll(-scroll_x * TILE_SIZE, -scroll_y * TILE_SIZE)
+            exposed = []
+            if scroll_x > 0:
+                exposed.append(pygame.Rect(viewport.right - scroll_x * TILE_SIZE, 0, scroll_x * TILE_SIZE, viewport.height))
+            elif scroll_x < 0:
+                exposed.append(pygame.Rect(0, 0, -scroll_x * TILE_SIZE, viewport.height))
+            if scroll_y > 0:
+                exposed.append(pygame.Rect(0, viewport.bottom - scroll_y * TILE_SIZE, viewport.width, scroll_y * TILE_SIZE))
+            elif scroll_y < 0:
+                exposed.append(pygame.Rect(0, 0, viewport.width, -scroll_y * TILE_SIZE))
+            exposed += [self.tile_rect(box, offset_x, offset_y) for box in fog_changes]
+            for region in exposed:
+                self.screen.fill(BLACK, region)
+                self.screen.blit(layer.surface, region, region.move(view.x, view.y))
+                self.screen.blit(fog, region, region.move(view.x, view.y), special_flags=pygame.BLEND_MULT)
+            self.screen.blits(batch, doreturn=False)
+            self.damage.add(viewport)
+        elif batch != self.drawn_entities or refreshed or fog_changes:
+            # Same camera: repaint only the tiles under entities that moved
+            # and terrain that changed, then the entities touching them
+            removed = list(self.drawn_entities)
+            added = []
+            for item in batch:
+                if item in removed:
+                    removed.remove(item)
+                else:
+                    added.append(item)
+            regions = [region.move(-view.x, -view.y) for region in refreshed]
+            regions += [self.glyph_rect(item) for item in removed + added]
+            regions += [self.tile_rect(box, offset_x, offset_y).clip(viewport) for box in fog_changes]
+            redraw = []
+            pending = list(batch)
+            found = True
+            while found:
+                # Entities overlapping a repainted region must be repainted whole
+                found = False
+                for item in list(pending):
+                    rect = self.glyph_rect(item)
+                    if rect.collidelist(regions) != -1:
+                        regions.append(rect)
+                        redraw.append(item)
+                        pending.remove(item)
+                        found = True
+            for region in regions:
+                self.screen.fill(BLACK, region)
+                self.screen.blit(layer.surface, region, region.move(view.x, view.y))
+                self.screen.blit(fog, region, region.move(view.x, view.y), special_flags=pygame.BLEND_MULT)
+                self.damage.add(region.clip(viewport))
+            self.screen.blits([item for item in batch if item in redraw], doreturn=False)
+        self.screen.set_clip(None)
+        self.drawn_view = view_key
+        self.drawn_entities = batch
+        self.drawn_fov = (fov.revision, fov.box)
+
+    def tile_rect(self, box, offset_x, offset_y):
+        # Screen rectangle of a rectangle of map tiles
+        return pygame.Rect((box.x - offset_x) * TILE_SIZE, (box.y - offset_y) * TILE_SIZE, box.width * TILE_SIZE, box.height * TILE_SIZE)
+
+    def glyph_rect(self, item):
+        source, dest, area = item
+        return pygame.Rect(dest, area.size if area is not None else source.get_size())
 
     def draw_panel(self):
         if not self.hud_visible:
             return  # Do not draw HUD if it's hidden
 
         panel_x = VIEWPORT_WIDTH * TILE_SIZE
-        panel_width = WINDOW_WIDTH - panel_x
-        pygame.draw.rect(self.screen, PANEL_BG, (panel_x, 0, panel_width, WINDOW_HEIGHT))
+        panel_key = (self.level, self.xp, self.gold, self.health, self.max_health,
+                     tuple(self.inventory), tuple(self.events[-(WINDOW_HEIGHT // 20):]), self.message)
+        if panel_key != self.panel_key:
+            self.panel_key = panel_key
+            self.render_panel()
+        elif not self.damage.full:
+            return
+        self.screen.blit(self.panel_surface, (panel_x, 0))
+        self.damage.add(self.panel_surface.get_rect(x=panel_x))
+
+    def render_panel(self):
+        # Re-render the cached sidebar; only called when a shown value changed
+        panel = self.panel_surface
+        panel.fill(PANEL_BG)
 
         y_offset = 10
-        x_offset = panel_x + 10
+        x_offset = 10
 
         # Stats
-        draw_text(self.screen, 'Stats', x_offset, y_offset, PANEL_TEXT)
+        self.draw_text(panel, 'Stats', x_offset, y_offset, PANEL_TEXT)
         y_offset += 20
-        draw_text(self.screen, f'Level: {self.level}', x_offset, y_offset, PANEL_TEXT)
+        self.draw_text(panel, f'Level: {self.level}', x_offset, y_offset, PANEL_TEXT)
         y_offset += 20
-        draw_text(self.screen, f'XP: {self.xp}', x_offset, y_offset, PANEL_TEXT)
+        self.draw_text(panel, f'XP: {self.xp}', x_offset, y_offset, PANEL_TEXT)
         y_offset += 20
-        draw_text(self.screen, f'Gold: {self.gold}', x_offset, y_offset, PANEL_TEXT)
+        self.draw_text(panel, f'Gold: {self.gold}', x_offset, y_offset, PANEL_TEXT)
         y_offset += 20
 
         # Health
         y_offset += 10
-        draw_text(self.screen, 'Health', x_offset, y_offset, PANEL_TEXT)
+        self.draw_text(panel, 'Health', x_offset, y_offset, PANEL_TEXT)
         y_offset += 20
-        draw_text(self.screen, f'HP: {self.health}/{self.max_health}', x_offset, y_offset, PANEL_TEXT)
+        self.draw_text(panel, f'HP: {self.health}/{self.max_health}', x_offset, y_offset, PANEL_TEXT)
         y_offset += 20
 
         # Inventory
         y_offset += 10
-        draw_text(self.screen, 'Inventory (Press I)', x_offset, y_offset, PANEL_TEXT)
+        self.draw_text(panel, 'Inventory (Press I)', x_offset, y_offset, PANEL_TEXT)
         y_offset += 20
         if self.inventory:
             for item in self.inventory:
-                draw_text(self.screen, f'- {item}', x_offset, y_offset, PANEL_TEXT)
+                self.draw_text(panel, f'- {item}', x_offset, y_offset, PANEL_TEXT)
                 y_offset += 20
         else:
-            draw_text(self.screen, 'Empty', x_offset, y_offset, PANEL_TEXT)
+            self.draw_text(panel, 'Empty', x_offset, y_offset, PANEL_TEXT)
             y_offset += 20
 
         # Events
         y_offset += 10
-        draw_text(self.screen, 'Events', x_offset, y_offset, PANEL_TEXT)
+        self.draw_text(panel, 'Events', x_offset, y_offset, PANEL_TEXT)
         y_offset += 20
         panel_height = WINDOW_HEIGHT - y_offset - 20
         lines_to_show = panel_height // 20
         events_to_show = self.events[-lines_to_show:]
         for event in events_to_show:
-            wrapped_text = textwrap.wrap(event, width=30)  # Adjust width as needed
-            for line in wrapped_text:
-                draw_text(self.screen, line, x_offset, y_offset, PANEL_TEXT)
+            for line in wrap_event(event):
+                self.draw_text(panel, line, x_offset, y_offset, PANEL_TEXT)
                 y_offset += 20
                 if y_offset > WINDOW_HEIGHT - 20:
                     break
@@ -1395,7 +1653,7 @@ class Game:
         # Message (for examine action)
         if self.message:
             y_offset += 20
-            self.draw_text(self.screen, self.message, x_offset, y_offset, PANEL_TEXT)
+            self.draw_text(panel, self.message, x_offset, y_offset, PANEL_TEXT)
             self.message = ''  # Clear message after displaying
 
 if __name__ == '__main__':
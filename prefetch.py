@@ -0,0 +1,91 @@
+# prefetch.py
+
+from concurrent.futures import ThreadPoolExecutor
+from config import *
+from render import TerrainLayer
+from tilemap import TileMap
+import worldgen
+
+
+def build_cell(world_seed, cell_x, cell_y, cell_data, atlas):
+    # Runs on the worker: the cell's map as generated, and its terrain layer
+    local_map = worldgen.generate_cell_map(world_seed, cell_x, cell_y, cell_data)
+    return local_map, TerrainLayer(local_map, atlas)
+
+
+def build_dungeon_level(world_seed, cell, entrance, level, max_level):
+    # Runs on the worker: the level's tiles as generated and where the player
+    # arrives on it. The tiles are kept as bytes, since each visit needs its
+    # own copy to replay changes into.
+    dungeon_map, arrival = worldgen.generate_dungeon_level(world_seed, cell, entrance, level, max_level)
+    return bytes(dungeon_map.tiles), arrival
+
+
+class CellPrefetcher:
+    # Builds the cells next to the player's current one on a worker thread
+    # while the player walks toward an edge, so crossing into one of them only
+    # has to pick up the finished map and terrain layer
+    def __init__(self, world_seed, world_map, atlas):
+        self.world_seed = world_seed
+        self.world_map = world_map
+        self.atlas = atlas
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cell-prefetch')
+        self.pending = {}  # Key: (cell_x, cell_y), Value: Future of (local_map, layer)
+
+    def prefetch(self, cells):
+        # Start building the given cells and drop any other prefetched ones
+        for cell in list(self.pending):
+            if cell not in cells:
+                self.pending.pop(cell).cancel()
+        for cell_x, cell_y in cells:
+            if (cell_x, cell_y) not in self.pending:
+                self.pending[(cell_x, cell_y)] = self.executor.submit(
+                    build_cell, self.world_seed, cell_x, cell_y, self.world_map.cell(cell_x, cell_y), self.atlas)
+
+    def take(self, cell):
+        # The prefetched (local_map, layer) of a cell, waiting for it if it is
+        # still being built, or None if it was never requested
+        future = self.pending.pop(cell, None)
+        self.prefetch([])
+        if future is None or future.cancelled():
+            return None
+        return future.result()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class DungeonPrefetcher:
+    # Generates every level of a dungeon on a worker thread once the player
+    # is near its entrance. Levels are kept while the dungeon is in play, so
+    # taking the stairs only copies a finished tile buffer into a new map.
+    def __init__(self, world_seed):
+        self.world_seed = world_seed
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dungeon-prefetch')
+        self.pending = {}  # Key: (cell, entrance), Value: list of Futures of (tiles, arrival), by level
+
+    def prefetch(self, dungeons):
+        # Start generating the given (cell, entrance) dungeons and drop any others
+        for dungeon in list(self.pending):
+            if dungeon not in dungeons:
+                for future in self.pending.pop(dungeon):
+                    future.cancel()
+        for cell, entrance in dungeons:
+            if (cell, entrance) not in self.pending:
+                max_level = worldgen.dungeon_depth(self.world_seed, cell, entrance)
+                self.pending[(cell, entrance)] = [
+                    self.executor.submit(build_dungeon_level, self.world_seed, cell, entrance, level, max_level)
+                    for level in range(1, max_level + 1)
+                ]
+
+    def take(self, cell, entrance, level):
+        # A prefetched level as (dungeon_map, arrival), waiting for it if it is
+        # still being generated, or None if it was never requested
+        futures = self.pending.get((cell, entrance))
+        if futures is None or not 1 <= level <= len(futures) or futures[level - 1].cancelled():
+            return None
+        tiles, arrival = futures[level - 1].result()
+        return TileMap(LOCAL_MAP_WIDTH, LOCAL_MAP_HEIGHT, tiles=bytearray(tiles)), arrival
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
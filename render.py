@@ -0,0 +1,265 @@
+# render.py
+
+import pygame
+from config import *
+from tilemap import explored_flags
+
+
+class GlyphAtlas:
+    # Every (char, color) pair the local map can show, rendered once into a
+    # single sheet so a whole viewport can be drawn with one Surface.blits()
+    def __init__(self, font, glyphs):
+        self.font = font
+        self.areas = {}
+        self.extra = {}  # Glyphs requested at runtime that were not pre-rendered
+
+        surfaces = {}
+        for char, color in glyphs:
+            surfaces[(char, color)] = font.render(char, True, color)
+
+        sheet_width = max(1, sum(surface.get_width() for surface in surfaces.values()))
+        sheet_height = max([1] + [surface.get_height() for surface in surfaces.values()])
+        self.sheet = pygame.Surface((sheet_width, sheet_height), pygame.SRCALPHA)
+        self.sheet.fill((0, 0, 0, 0))
+
+        x = 0
+        for key, surface in surfaces.items():
+            # BLEND_RGBA_MAX onto a cleared sheet copies the glyph pixels exactly
+            self.sheet.blit(surface, (x, 0), special_flags=pygame.BLEND_RGBA_MAX)
+            self.areas[key] = pygame.Rect(x, 0, surface.get_width(), surface.get_height())
+            x += surface.get_width()
+
+    def entry(self, char, color):
+        # Returns (source surface, source area) for a glyph
+        key = (char, color)
+        area = self.areas.get(key)
+        if area is not None:
+            return self.sheet, area
+        surface = self.extra.get(key)
+        if surface is None:
+            surface = self.font.render(char, True, color)
+            self.extra[key] = surface
+        return surface, None
+
+    def blit_item(self, char, color, x, y):
+        # A (source, dest, area) triple for Surface.blits()
+        source, area = self.entry(char, color)
+        return (source, (x, y), area)
+
+
+def tile_glyphs(player_char, player_color):
+    # Terrain, enemy, villager and player glyphs in drawing order, without duplicates
+    glyphs = [(tile['char'], tile['color']) for tile in TILES.values()]
+    glyphs += [(stats['char'], stats['color']) for stats in ENEMY_STATS.values()]
+    glyphs.append((VILLAGER_STATS['char'], VILLAGER_STATS['color']))
+    glyphs.append((player_char, player_color))
+    return list(dict.fromkeys(glyphs))
+
+
+class TerrainLayer:
+    # Pre-rendered terrain for a whole local map or dungeon level. Only tiles
+    # marked dirty are re-rendered; the viewport is a sub-rectangle blit.
+    def __init__(self, local_map, atlas):
+        self.local_map = local_map
+        self.atlas = atlas
+        self.width = local_map.width
+        self.height = local_map.height
+        # Atlas entry per tile ID
+        self.entries = [atlas.entry(char, color) for char, color in zip(TILE_CHARS, TILE_COLORS)]
+        self.surface = pygame.Surface((self.width * TILE_SIZE, self.height * TILE_SIZE))
+        self.dirty = set()
+
+        # Glyphs may be larger than a tile and overhang into their neighbours
+        glyph_width = max([TILE_SIZE] + [area.width for area in atlas.areas.values()])
+        glyph_height = max([TILE_SIZE] + [area.height for area in atlas.areas.values()])
+        self.glyph_size = (glyph_width, glyph_height)
+        self.overhang = (max(glyph_width, glyph_height) + TILE_SIZE - 1) // TILE_SIZE
+
+        self.render_all()
+
+    def tile_item(self, x, y):
+        source, area = self.entries[self.local_map.get(x, y)]
+        return (source, (x * TILE_SIZE, y * TILE_SIZE), area)
+
+    def render_all(self):
+        self.surface.fill(BLACK)
+        entries = self.entries
+        tiles = self.local_map.tiles
+        batch = []
+        for index, tile_id in enumerate(tiles):
+            source, area = entries[tile_id]
+            batch.append((source, ((index % self.width) * TILE_SIZE, (index // self.width) * TILE_SIZE), area))
+        self.surface.blits(batch, doreturn=False)
+        self.dirty.clear()
+
+    def mark_dirty(self, x, y):
+        self.dirty.add((x, y))
+
+    def refresh(self):
+        # Re-render dirty tiles and return the layer regions that changed
+        regions = [self.render_tile(x, y) for x, y in self.dirty]
+        self.dirty.clear()
+        return regions
+
+    def render_tile(self, x, y):
+        # Clear everything the old glyph could have covered, then redraw every
+        # glyph that reaches into that region in the original row-major order
+        region = pygame.Rect(x * TILE_SIZE, y * TILE_SIZE, *self.glyph_size)
+        self.surface.set_clip(region)
+        self.surface.fill(BLACK, region)
+        batch = []
+        for ny in range(max(0, y - self.overhang), min(self.height, y + self.overhang + 1)):
+            for nx in range(max(0, x - self.overhang), min(self.width, x + self.overhang + 1)):
+                batch.append(self.tile_item(nx, ny))
+        self.surface.blits(batch, doreturn=False)
+        self.surface.set_clip(None)
+        return region
+
+
+class TerrainCache:
+    # Terrain layers for the most recently drawn maps. A full-size layer is
+    # several megabytes, so only TERRAIN_CACHE_SIZE of them are kept.
+    def __init__(self, atlas, size=TERRAIN_CACHE_SIZE):
+        self.atlas = atlas
+        self.size = size
+        self.layers = {}  # Key: id(local_map), kept in least-recently-used order
+
+    def layer_for(self, local_map):
+        layer = self.layers.get(id(local_map))
+        # The layer holds a reference to its map, so the id cannot be reused while cached
+        if layer is None or layer.local_map is not local_map:
+            layer = TerrainLayer(local_map, self.atlas)
+        self.add(layer)
+        return layer
+
+    def add(self, layer):
+        # Also used for layers rendered ahead of time, e.g. by the cell prefetcher
+        key = id(layer.local_map)
+        self.layers.pop(key, None)
+        self.layers[key] = layer
+        while len(self.layers) > self.size:
+            del self.layers[next(iter(self.layers))]
+
+    def mark_dirty(self, local_map, x, y):
+        layer = self.layers.get(id(local_map))
+        if layer is not None and layer.local_map is local_map:
+            layer.mark_dirty(x, y)
+
+
+class FogLayer:
+    # The fog over a whole map, the same size as its terrain layer, to be
+    # multiplied into the terrain: black where unexplored, FOG_SEEN_COLOR where
+    # explored but out of view and white in view. It is filled from the map's
+    # explored bitset a run of explored tiles at a time; after that only the
+    # tiles coming into or going out of view are refilled. The surface of the
+    # previous layer is reused when it is the same size, as allocating one
+    # takes longer than filling it.
+    def __init__(self, local_map, previous=None):
+        self.local_map = local_map
+        self.visible = set()
+        width = local_map.width
+        size = (width * TILE_SIZE, local_map.height * TILE_SIZE)
+        if previous is not None and previous.surface.get_size() == size:
+            self.surface = previous.surface
+        else:
+            self.surface = pygame.Surface(size)
+        self.surface.fill(BLACK)
+        for y in range(local_map.height):
+            flags = explored_flags(local_map.explored, y * width, width)
+            start = flags.find(1)
+            while start != -1:
+                end = flags.find(0, start)
+                if end == -1:
+                    end = width
+                self.surface.fill(FOG_SEEN_COLOR, (start * TILE_SIZE, y * TILE_SIZE, (end - start) * TILE_SIZE, TILE_SIZE))
+                start = flags.find(1, end)
+
+    def update(self, visible):
+        # Follow a new set of tile indices in view
+        width = self.local_map.width
+        for index in visible - self.visible:
+            self.surface.fill(WHITE, ((index % width) * TILE_SIZE, (index // width) * TILE_SIZE, TILE_SIZE, TILE_SIZE))
+        for index in self.visible - visible:
+            # Out of view again, so explored
+            self.surface.fill(FOG_SEEN_COLOR, ((index % width) * TILE_SIZE, (index // width) * TILE_SIZE, TILE_SIZE, TILE_SIZE))
+        self.visible = visible
+
+
+class WorldMapCache:
+    # The world map pre-rendered in square pages of WORLD_PAGE_CELLS cells.
+    # Pages are drawn the first time they are shown and the least recently
+    # used are dropped, so cost and memory follow what is on screen. World
+    # cells never change once generated; a new world gets a new cache.
+    def __init__(self, world_map):
+        self.world_map = world_map
+        self.pages = {}  # Key: (page_x, page_y), kept in least-recently-used order
+
+    def page(self, page_x, page_y):
+        key = (page_x, page_y)
+        surface = self.pages.pop(key, None)
+        if surface is None:
+            first_x = page_x * WORLD_PAGE_CELLS
+            first_y = page_y * WORLD_PAGE_CELLS
+            surface = pygame.Surface((WORLD_PAGE_CELLS * CELL_SIZE, WORLD_PAGE_CELLS * CELL_SIZE))
+            for y in range(WORLD_PAGE_CELLS):
+                for x in range(WORLD_PAGE_CELLS):
+                    cell_data = self.world_map.cell(first_x + x, first_y + y)
+                    color = BIOME_COLORS[cell_data['biome']]
+                    rect = pygame.Rect(x * CELL_SIZE, y * CELL_SIZE, CELL_SIZE, CELL_SIZE)
+                    pygame.draw.rect(surface, color, rect)
+                    pygame.draw.rect(surface, BLACK, rect, 1)  # Cell border
+                    if cell_data['town']:
+                        # Draw town marker
+                        pygame.draw.circle(surface, YELLOW, rect.center, CELL_SIZE // 4)
+        self.pages[key] = surface
+        while len(self.pages) > WORLD_PAGE_CACHE_SIZE:
+            del self.pages[next(iter(self.pages))]
+        return surface
+
+    def draw(self, surface, camera, area):
+        # Blit every page that overlaps the screen area, with camera the top-left cell
+        camera_x, camera_y = camera
+        page_size = WORLD_PAGE_CELLS * CELL_SIZE
+        first_x = camera_x // WORLD_PAGE_CELLS
+        first_y = camera_y // WORLD_PAGE_CELLS
+        last_x = (camera_x * CELL_SIZE + area.width) // page_size
+        last_y = (camera_y * CELL_SIZE + area.height) // page_size
+        batch = []
+        for page_y in range(first_y, last_y + 1):
+            for page_x in range(first_x, last_x + 1):
+                dest = (area.x + page_x * page_size - camera_x * CELL_SIZE,
+                        area.y + page_y * page_size - camera_y * CELL_SIZE)
+                batch.append((self.page(page_x, page_y), dest))
+        surface.set_clip(area)
+        surface.blits(batch, doreturn=False)
+        surface.set_clip(None)
+
+    def draw_cell(self, surface, cell, dest):
+        # Restore a single cell, e.g. to erase a highlight
+        page = self.page(cell[0] // WORLD_PAGE_CELLS, cell[1] // WORLD_PAGE_CELLS)
+        area = pygame.Rect((cell[0] % WORLD_PAGE_CELLS) * CELL_SIZE, (cell[1] % WORLD_PAGE_CELLS) * CELL_SIZE, CELL_SIZE, CELL_SIZE)
+        surface.blit(page, dest, area)
+
+
+class DamageTracker:
+    # Collects the screen regions that changed this frame and presents only
+    # those. A full flip happens only after invalidate(), i.e. on scene changes.
+    def __init__(self, screen):
+        self.screen_rect = screen.get_rect()
+        self.rects = []
+        self.full = True
+
+    def invalidate(self):
+        self.full = True
+
+    def add(self, rect):
+        if not self.full:
+            self.rects.append(pygame.Rect(rect).clip(self.screen_rect))
+
+    def present(self):
+        if self.full:
+            pygame.display.flip()
+        elif self.rects:
+            pygame.display.update(self.rects)
+        self.rects = []
+        self.full = False
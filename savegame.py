@@ -0,0 +1,349 @@
+# savegame.py
+#
+# Binary save files. All numbers are little-endian. A file is a header,
+# which also carries the id of the autosave journal that follows it (see
+# journal.py; 0 for saves made by hand), followed by these sections in order:
+#
+#   player     position, stats, clock and turn count
+#   place      current and selected world cell, HUD flag, dungeon flag,
+#              then the dungeon position if the player is in one
+#   text       state, local map biome, message, inventory, equipped items, events
+#   map        the current local map as raw tile IDs, then the map stack
+#   cells      every visited world cell: position, turn last simulated,
+#              biome, tile changes, explored tiles, entities
+#   dungeons   every visited dungeon level: key, tile changes, explored tiles, enemies
+#
+# Tile grids are stored as packed width x height byte arrays and tile changes
+# as a packed array of indices followed by a packed array of tile IDs, so both
+# load as single slices of the memory-mapped file. Explored tiles are the
+# map's bitset as it is kept in memory. Enemies and villagers are
+# fixed-width records. Maps themselves are rebuilt from the world seed.
+
+import array
+import mmap
+import os
+import struct
+import sys
+from config import *
+from entities import Enemy, Villager
+from tilemap import TileMap
+
+SAVE_MAGIC = b'VSAV'
+SAVE_VERSION = 4
+
+HEADER = struct.Struct('<4sHIQ')  # Magic, version, world seed, journal id
+PLAYER = struct.Struct('<iiiiiiiidq')  # x, y, level, attack, xp, gold, health, max health, time, turn
+PLACE = struct.Struct('<iiii??')  # Current cell, selected cell, HUD visible, in dungeon
+DUNGEON = struct.Struct('<iiii')  # Level, max level, entrance x, entrance y
+GRID = struct.Struct('<II')  # Width, height; followed by width * height tile IDs
+STACK_ENTRY = struct.Struct('<iiii')  # Player x, y, cell x, y; followed by biome and grid
+CELL = struct.Struct('<iiiiq')  # Cell x, y, player x, y, turn last simulated; followed by biome, changes, explored tiles, enemies, villagers
+DUNGEON_LEVEL = struct.Struct('<iiiii')  # Cell x, y, entrance x, y, level; followed by changes, explored tiles, enemies
+ENEMY = struct.Struct('<iiBiiiii')  # x, y, type, attack, health, max health, xp, gold
+VILLAGER = struct.Struct('<ii')  # x, y
+COUNT = struct.Struct('<I')
+STRING = struct.Struct('<H')  # Byte length of the UTF-8 text that follows
+
+ENEMY_TYPES = list(ENEMY_STATS)
+ENEMY_TYPE_IDS = {enemy_type: type_id for type_id, enemy_type in enumerate(ENEMY_TYPES)}
+SAVED_STATES = ('local_map', 'map_mode', 'dungeon')  # Game states a save can resume in
+
+
+class SaveWriter:
+    def __init__(self):
+        self.chunks = []
+
+    def pack(self, record, *values):
+        self.chunks.append(record.pack(*values))
+
+    def string(self, text):
+        data = text.encode('utf-8')
+        self.chunks.append(STRING.pack(len(data)))
+        self.chunks.append(data)
+
+    def strings(self, texts):
+        self.pack(COUNT, len(texts))
+        for text in texts:
+            self.string(text)
+
+    def grid(self, tile_map):
+        self.pack(GRID, tile_map.width, tile_map.height)
+        self.chunks.append(bytes(tile_map.tiles))
+
+    def changes(self, changes):
+        indices = array.array('I', changes.keys())
+        if sys.byteorder == 'big':
+            indices.byteswap()
+        self.pack(COUNT, len(changes))
+        self.chunks.append(indices.tobytes())
+        self.chunks.append(bytes(changes.values()))
+
+    def bits(self, bits):
+        self.pack(COUNT, len(bits))
+        self.chunks.append(bytes(bits))
+
+    def enemies(self, enemies):
+        self.pack(COUNT, len(enemies))
+        for enemy in enemies:
+            self.pack(ENEMY, enemy.x, enemy.y, ENEMY_TYPE_IDS[enemy.name], enemy.attack,
+                      enemy.health, enemy.max_health, enemy.xp, enemy.gold)
+
+    def villagers(self, villagers):
+        self.pack(COUNT, len(villagers))
+        for villager in villagers:
+            self.pack(VILLAGER, villager.x, villager.y)
+
+
+class SaveReader:
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.offset = 0
+
+    def unpack(self, record):
+        values = record.unpack_from(self.buffer, self.offset)
+        self.offset += record.size
+        return values
+
+    def take(self, size):
+        if self.offset + size > len(self.buffer):
+            raise ValueError('Save file is truncated')
+        data = self.buffer[self.offset:self.offset + size]
+        self.offset += size
+        return data
+
+    def string(self):
+        length, = self.unpack(STRING)
+        return self.take(length).decode('utf-8')
+
+    def strings(self):
+        count, = self.unpack(COUNT)
+        return [self.string() for _ in range(count)]
+
+    def grid(self):
+        width, height = self.unpack(GRID)
+        tiles = bytearray(self.take(width * height))
+        if tiles and max(tiles) >= len(TILE_TYPES):
+            raise ValueError('Save file has an unknown tile')
+        return TileMap(width, height, tiles=tiles)
+
+    def changes(self):
+        count, = self.unpack(COUNT)
+        indices = array.array('I')
+        indices.frombytes(self.take(count * 4))
+        if sys.byteorder == 'big':
+            indices.byteswap()
+        tile_ids = self.take(count)
+        if tile_ids and max(tile_ids) >= len(TILE_TYPES):
+            raise ValueError('Save file has an unknown tile')
+        return dict(zip(indices, tile_ids))
+
+    def bits(self):
+        count, = self.unpack(COUNT)
+        return bytearray(self.take(count))
+
+    def enemies(self):
+        count, = self.unpack(COUNT)
+        enemies = []
+        for x, y, type_id, attack, health, max_health, xp, gold in ENEMY.iter_unpack(self.take(count * ENEMY.size)):
+            if type_id >= len(ENEMY_TYPES):
+                raise ValueError(f'Save file has an unknown enemy type {type_id}')
+            enemy = Enemy(x, y, ENEMY_TYPES[type_id], attack=attack, gold=gold)
+            enemy.health, enemy.max_health, enemy.xp = health, max_health, xp
+            enemies.append(enemy)
+        return enemies
+
+    def villagers(self):
+        count, = self.unpack(COUNT)
+        return [Villager(x, y) for x, y in VILLAGER.iter_unpack(self.take(count * VILLAGER.size))]
+
+
+def save_game(game, path, journal_id=0):
+    write_save(path, encode_game(game, journal_id))
+
+
+def write_save(path, data):
+    # Written to a temporary file first, so a failed save never clobbers the last one
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as save_file:
+        save_file.write(data)
+    os.replace(temp_path, path)
+
+
+def encode_game(game, journal_id=0):
+    in_dungeon = game.dungeon_key is not None
+    if not game.map_stack and not in_dungeon:
+        game.save_current_cell_state()
+
+    writer = SaveWriter()
+    writer.pack(HEADER, SAVE_MAGIC, SAVE_VERSION, game.world_seed, journal_id)
+    writer.pack(PLAYER, game.player_x, game.player_y, game.level, game.attack, game.xp, game.gold,
+                game.health, game.max_health, game.time, game.turn)
+    writer.pack(PLACE, *game.current_cell, *game.selected_cell, game.hud_visible, in_dungeon)
+    if in_dungeon:
+        writer.pack(DUNGEON, game.dungeon_level, game.max_dungeon_level, *game.dungeon_entrance_position)
+
+    writer.string(game.state)
+    writer.string(game.local_map_biome)
+    writer.string(game.message)
+    writer.strings(game.inventory)
+    writer.strings(game.equipped_items)
+    writer.strings(game.events)
+
+    writer.grid(game.local_map)
+    writer.pack(COUNT, len(game.map_stack))
+    for entry in game.map_stack:
+        writer.pack(STACK_ENTRY, entry['player_x'], entry['player_y'], *entry['current_cell'])
+        writer.string(entry['local_map_biome'])
+        writer.grid(entry['local_map'])
+
+    cells = list(game.world_cells.items())
+    writer.pack(COUNT, len(cells))
+    for (cell_x, cell_y), cell_data in cells:
+        writer.pack(CELL, cell_x, cell_y, cell_data['player_x'], cell_data['player_y'], cell_data['simulated_turn'])
+        writer.string(cell_data['biome'])
+        writer.changes(cell_data['tiles'])
+        writer.bits(cell_data['explored'])
+        writer.enemies(cell_data['enemies'])
+        writer.villagers(cell_data['villagers'])
+
+    levels = list(game.dungeon_levels.items())
+    writer.pack(COUNT, len(levels))
+    for ((cell_x, cell_y), (entrance_x, entrance_y), level), dungeon_data in levels:
+        writer.pack(DUNGEON_LEVEL, cell_x, cell_y, entrance_x, entrance_y, level)
+        writer.changes(dungeon_data['tiles'])
+        writer.bits(dungeon_data['explored'])
+        writer.enemies(dungeon_data['enemies'])
+
+    return b''.join(writer.chunks)
+
+
+def load_game(game, path):
+    # Raises OSError for unreadable files and ValueError or struct.error for
+    # files that are not valid saves; the game is only changed once all of it has been read.
+    # Returns the journal id stored with the save.
+    with open(path, 'rb') as save_file, mmap.mmap(save_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        reader = SaveReader(buffer)
+        magic, version, world_seed, journal_id = reader.unpack(HEADER)
+        if magic != SAVE_MAGIC:
+            raise ValueError('Not a save file')
+        if version != SAVE_VERSION:
+            raise ValueError(f'Unsupported save version {version}')
+        player = reader.unpack(PLAYER)
+        place = reader.unpack(PLACE)
+        in_dungeon = place[5]
+        dungeon = reader.unpack(DUNGEON) if in_dungeon else None
+
+        state = reader.string()
+        local_map_biome = reader.string()
+        message = reader.string()
+        inventory = reader.strings()
+        equipped_items = reader.strings()
+        events = reader.strings()
+
+        local_map = reader.grid()
+        map_stack = []
+        for _ in range(reader.unpack(COUNT)[0]):
+            player_x, player_y, cell_x, cell_y = reader.unpack(STACK_ENTRY)
+            biome = reader.string()
+            map_stack.append({
+                'local_map': reader.grid(),
+                'local_map_biome': biome,
+                'player_x': player_x,
+                'player_y': player_y,
+                'current_cell': (cell_x, cell_y),
+            })
+
+        cells = []
+        for _ in range(reader.unpack(COUNT)[0]):
+            cell_x, cell_y, player_x, player_y, simulated_turn = reader.unpack(CELL)
+            cells.append(((cell_x, cell_y), {
+                'biome': reader.string(),
+                'tiles': reader.changes(),
+                'explored': reader.bits(),
+                'player_x': player_x,
+                'player_y': player_y,
+                'enemies': reader.enemies(),
+                'villagers': reader.villagers(),
+                'simulated_turn': simulated_turn,
+            }))
+
+        levels = []
+        for _ in range(reader.unpack(COUNT)[0]):
+            cell_x, cell_y, entrance_x, entrance_y, level = reader.unpack(DUNGEON_LEVEL)
+            levels.append((((cell_x, cell_y), (entrance_x, entrance_y), level), {
+                'tiles': reader.changes(),
+                'explored': reader.bits(),
+                'enemies': reader.enemies(),
+            }))
+
+    # Check that the player is somewhere playable and that the maps in play
+    # have their stored state before anything in the game is replaced
+    if state not in SAVED_STATES or (state == 'dungeon') != in_dungeon:
+        raise ValueError(f'Save file has an unknown game state {state!r}')
+    if not local_map.in_bounds(player[0], player[1]):
+        raise ValueError(f'Save file puts the player outside the map at {player[0], player[1]}')
+    for entry in map_stack:
+        if not entry['local_map'].in_bounds(entry['player_x'], entry['player_y']):
+            raise ValueError(f"Save file puts the player outside the map at {entry['player_x'], entry['player_y']}")
+    linked_cells = [entry['current_cell'] for entry in map_stack]
+    if in_dungeon:
+        dungeon_key = ((place[0], place[1]), (dungeon[2], dungeon[3]), dungeon[0])
+        if dungeon_key not in {level_key for level_key, _ in levels}:
+            raise ValueError(f'Save file is missing dungeon level {dungeon_key}')
+    elif not map_stack:
+        linked_cells.append((place[0], place[1]))
+    cell_keys = {cell_key for cell_key, _ in cells}
+    for cell_key in linked_cells:
+        if cell_key not in cell_keys:
+            raise ValueError(f'Save file is missing cell {cell_key}')
+
+    (game.player_x, game.player_y, game.level, game.attack, game.xp, game.gold,
+     game.health, game.max_health, game.time, game.turn) = player
+    game.current_cell = place[0], place[1]
+    game.selected_cell = place[2], place[3]
+    game.hud_visible = place[4]
+    game.start_world(world_seed)
+    for cell_key, cell_data in cells:
+        game.world_cells[cell_key] = cell_data
+    for level_key, dungeon_data in levels:
+        game.dungeon_levels[level_key] = dungeon_data
+    game.world_map.keep_around(game.current_cell)
+
+    game.state = state
+    game.local_map_biome = local_map_biome
+    game.message = message
+    game.inventory = inventory
+    game.equipped_items = equipped_items
+    game.events = events
+
+    # Entities and tile changes are shared with the stores, so the maps in
+    # play keep recording into them
+    for entry in map_stack:
+        cell_data = game.world_cells[entry['current_cell']]
+        entry['local_map'].changes = cell_data['tiles']
+        entry['local_map'].explored = cell_data['explored']
+        entry['enemies'] = cell_data['enemies']
+        entry['villagers'] = cell_data['villagers']
+    game.map_stack = map_stack
+    game.local_map = local_map
+    game.dungeon_key = None
+    if in_dungeon:
+        game.dungeon_level, game.max_dungeon_level = dungeon[0], dungeon[1]
+        game.dungeon_entrance_position = (dungeon[2], dungeon[3])
+        game.dungeon_key = (game.current_cell, game.dungeon_entrance_position, game.dungeon_level)
+        dungeon_data = game.dungeon_levels[game.dungeon_key]
+        local_map.changes = dungeon_data['tiles']
+        local_map.explored = dungeon_data['explored']
+        game.enemies = dungeon_data['enemies']
+        game.villagers = []
+    elif map_stack:
+        # Inside a building
+        game.enemies = []
+        game.villagers = []
+    else:
+        cell_data = game.world_cells[game.current_cell]
+        local_map.changes = cell_data['tiles']
+        local_map.explored = cell_data['explored']
+        game.enemies = cell_data['enemies']
+        game.villagers = cell_data['villagers']
+    return journal_id
@@ -0,0 +1,65 @@
+# Shared setup for the tests: a headless display, the game modules on the
+# path and games that autosave into a temporary directory
+
+import os
+import sys
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame
+import pytest
+from config import *
+import main
+
+
+@pytest.fixture
+def new_game(tmp_path, monkeypatch):
+    # Start Game instances, each a session autosaving to the same file, and
+    # stop their threads afterwards
+    monkeypatch.chdir(tmp_path)
+    games = []
+
+    def start():
+        game = main.Game()
+        game.autosave_file = str(tmp_path / 'valdmir.autosave')
+        games.append(game)
+        return game
+
+    yield start
+    for game in games:
+        if game.journal is not None:
+            game.journal.close()
+        game.prefetcher.shutdown()
+        game.dungeon_prefetcher.shutdown()
+
+
+def press(game, key):
+    # Handle one key press as the game loop would
+    pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=key, mod=0, unicode=''))
+    game.handle_events()
+
+
+def spawn(game):
+    # Start a new game on the first walkable cell without a town near the origin
+    press(game, pygame.K_SPACE)
+    for distance in range(WORLD_CHUNK_CELLS):
+        cell = (distance, 0)
+        if TILE_WALKABLE[TILE_IDS[game.world_map.cell(*cell)['biome']]] and not game.world_map.cell(*cell)['town']:
+            break
+    game.selected_cell = cell
+    press(game, pygame.K_RETURN)
+    assert game.state == 'local_map'
+
+
+def take_steps(game, count):
+    # Step count turns to walkable neighbours, with nothing about to fight or trade
+    game.enemies.clear()
+    game.villagers.clear()
+    for _ in range(count):
+        for dx, dy in ((1, 0), (0, 1), (-1, 0), (0, -1)):
+            if 0 < game.player_x + dx < game.local_map.width - 1 and 0 < game.player_y + dy < game.local_map.height - 1 \
+                    and game.local_map.walkable(game.player_x + dx, game.player_y + dy):
+                game.move_player(dx, dy)
+                game.end_turn()
+                break
@@ -0,0 +1,58 @@
+import pygame
+from conftest import press, spawn, take_steps
+
+
+def crash(game):
+    # The process dies once the journal has reached the file: nothing more
+    # is written, and no new session has touched the autosave yet
+    game.journal.close()
+    game.journal = None
+
+
+def test_new_session_recovers_crashed_session(new_game):
+    crashed = new_game()
+    spawn(crashed)
+    take_steps(crashed, 20)
+    expected = (crashed.turn, crashed.player_x, crashed.player_y, crashed.current_cell)
+    crash(crashed)
+
+    game = new_game()
+    assert game.state == 'main_menu' and game.has_autosave()
+    press(game, pygame.K_r)
+    assert game.state == 'local_map'
+    assert (game.turn, game.player_x, game.player_y, game.current_cell) == expected
+    assert game.events[-1] == 'Recovered autosave and 40 journal records.'
+    game.draw()
+
+
+def test_new_game_leaves_autosave_until_spawning(new_game, tmp_path):
+    crashed = new_game()
+    spawn(crashed)
+    take_steps(crashed, 5)
+    crash(crashed)
+    snapshot = (tmp_path / 'valdmir.autosave').read_bytes()
+    journal = (tmp_path / 'valdmir.autosave.journal').read_bytes()
+
+    game = new_game()
+    press(game, pygame.K_SPACE)
+    assert game.state == 'world_map'
+    assert (tmp_path / 'valdmir.autosave').read_bytes() == snapshot
+    assert (tmp_path / 'valdmir.autosave.journal').read_bytes() == journal
+
+
+def test_recover_after_leaving_building(new_game):
+    crashed = new_game()
+    spawn(crashed)
+    crashed.enter_building()
+    crashed.start_autosave()
+    crashed.exit_building()
+    take_steps(crashed, 5)
+    expected = (crashed.turn, crashed.player_x, crashed.player_y, crashed.local_map_biome)
+    crash(crashed)
+
+    game = new_game()
+    press(game, pygame.K_r)
+    assert game.map_stack == []
+    assert (game.turn, game.player_x, game.player_y, game.local_map_biome) == expected
+    assert (game.local_map.width, game.local_map.height) == (crashed.local_map.width, crashed.local_map.height)
+    game.draw()
@@ -0,0 +1,45 @@
+import struct
+import savegame
+from config import *
+from conftest import spawn
+
+
+def load_damaged(game, data):
+    # Load data as the save file through the load command; the game must be unchanged
+    with open(SAVE_FILE, 'wb') as save_file:
+        save_file.write(data)
+    before = (game.world_seed, game.state, game.player_x, game.player_y, game.local_map)
+    game.load_game()
+    assert game.events[-1].startswith('Could not load: ')
+    assert (game.world_seed, game.state, game.player_x, game.player_y, game.local_map) == before
+    game.draw()
+    return game.events[-1]
+
+
+def test_player_outside_map_is_rejected(new_game):
+    game = new_game()
+    spawn(game)
+    data = bytearray(savegame.encode_game(game))
+    struct.pack_into('<i', data, savegame.HEADER.size, 5000)  # Player x
+    assert 'outside the map' in load_damaged(game, bytes(data))
+
+
+def test_unknown_state_is_rejected(new_game):
+    game = new_game()
+    spawn(game)
+    game.state = 'nowhere'
+    data = savegame.encode_game(game)
+    game.state = 'local_map'
+    assert 'unknown game state' in load_damaged(game, data)
+
+
+def test_saved_game_loads(new_game):
+    game = new_game()
+    spawn(game)
+    with open(SAVE_FILE, 'wb') as save_file:
+        save_file.write(savegame.encode_game(game))
+    position = (game.player_x, game.player_y)
+    game.player_x += 1
+    game.load_game()
+    assert game.events[-1] == f'Game loaded from {SAVE_FILE}.'
+    assert (game.player_x, game.player_y) == position
@@ -0,0 +1,172 @@
+# tilemap.py
+
+import random
+from itertools import compress, count
+from config import *
+
+
+# Map revisions are drawn from one sequence, so a revision is never reused,
+# even by a map rebuilt with the same changes
+REVISIONS = count(1)
+
+
+def explored_bits(width, height):
+    # An empty explored-tiles bitset: one bit per tile, row-major, packed
+    # eight to a byte, so a 100 x 100 map takes 1250 bytes. It is stored with
+    # a map's saved state like its tile changes.
+    return bytearray((width * height + 7) // 8)
+
+
+# Each byte of a bitset unpacked to a 0 or 1 byte per bit
+UNPACKED_BITS = [bytes(byte >> bit & 1 for bit in range(8)) for byte in range(256)]
+
+
+def explored_flags(explored, start, count):
+    # Whether each of count tiles from index start is explored, one byte each
+    flags = b''.join([UNPACKED_BITS[byte] for byte in explored[start >> 3:(start + count + 7) >> 3]])
+    return flags[start & 7:(start & 7) + count]
+
+
+class TileMap:
+    # A local map, dungeon level or building interior. Tiles are stored as
+    # tile IDs, one byte each, in a contiguous row-major bytearray.
+    def __init__(self, width, height, fill='PLAIN', tiles=None):
+        self.width = width
+        self.height = height
+        if tiles is None:
+            tiles = bytearray([TILE_IDS[fill]]) * (width * height)
+        self.tiles = tiles
+        self.changes = {}  # Tiles changed after generation, index -> tile ID
+        self.revision = 0  # 0 while the map is as generated, a new value after every change
+        self.tile_index = None  # TileIndex, built on first use by index()
+        self.explored = explored_bits(width, height)  # Tiles the player has seen, see fov.py
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def get(self, x, y):
+        return self.tiles[y * self.width + x]
+
+    def set(self, x, y, tile_id):
+        index = y * self.width + x
+        if self.tile_index is not None:
+            self.tile_index.update(index, self.tiles[index], tile_id)
+        self.tiles[index] = tile_id
+
+    def change(self, x, y, tile_id):
+        # Set a tile and record it, so a regenerated map can be brought back
+        # to this state with apply_changes()
+        index = y * self.width + x
+        if self.tile_index is not None:
+            self.tile_index.update(index, self.tiles[index], tile_id)
+        self.tiles[index] = tile_id
+        self.changes[index] = tile_id
+        self.revision = next(REVISIONS)
+
+    def apply_changes(self, changes):
+        # Replay recorded changes; the map keeps recording into the same dict
+        for index, tile_id in changes.items():
+            if self.tile_index is not None:
+                self.tile_index.update(index, self.tiles[index], tile_id)
+            self.tiles[index] = tile_id
+        self.changes = changes
+        if changes:
+            self.revision = next(REVISIONS)
+
+    def walkable(self, x, y):
+        # Positions outside the map are never walkable
+        return 0 <= x < self.width and 0 <= y < self.height and TILE_WALKABLE[self.tiles[y * self.width + x]] == 1
+
+    def fill_rect(self, x, y, width, height, tile_id):
+        # Fill the part of the rectangle that lies inside the map
+        x1, y1 = max(0, x), max(0, y)
+        x2, y2 = min(self.width, x + width), min(self.height, y + height)
+        if x1 >= x2:
+            return
+        row = bytes([tile_id]) * (x2 - x1)
+        for row_y in range(y1, y2):
+            start = row_y * self.width + x1
+            if self.tile_index is not None:
+                for index in range(start, start + len(row)):
+                    self.tile_index.update(index, self.tiles[index], tile_id)
+            self.tiles[start:start + len(row)] = row
+
+    def distances_from(self, x, y, radius):
+        # Flow field: the walking distance to (x, y) of every tile that can
+        # reach it in at most radius steps, as a dict of (x, y) -> steps.
+        # Breadth-first over walkable tiles, four directions.
+        width, height, tiles = self.width, self.height, self.tiles
+        distances = {(x, y): 0}
+        frontier = [(x, y)]
+        for steps in range(1, radius + 1):
+            reached = []
+            for tile_x, tile_y in frontier:
+                for next_x, next_y in ((tile_x + 1, tile_y), (tile_x - 1, tile_y), (tile_x, tile_y + 1), (tile_x, tile_y - 1)):
+                    if (0 <= next_x < width and 0 <= next_y < height and (next_x, next_y) not in distances
+                            and TILE_WALKABLE[tiles[next_y * width + next_x]]):
+                        distances[(next_x, next_y)] = steps
+                        reached.append((next_x, next_y))
+            frontier = reached
+        return distances
+
+    def index(self):
+        # The map's TileIndex, kept up to date by every write once it is built
+        if self.tile_index is None:
+            self.tile_index = TileIndex(self)
+        return self.tile_index
+
+
+class TileIndex:
+    # Where a map's open tiles (see TILE_OPEN) are. They are kept in a list,
+    # with each one's slot in it, so adding, removing and sampling one at
+    # random all take constant time.
+    def __init__(self, tile_map):
+        self.width = tile_map.width
+        tiles = tile_map.tiles
+        self.open = list(compress(range(len(tiles)), tiles.translate(TILE_OPEN)))
+        self.open_slots = {index: slot for slot, index in enumerate(self.open)}
+
+    def update(self, index, old_id, new_id):
+        # Called before tile index changes from old_id to new_id
+        if TILE_OPEN[old_id] and not TILE_OPEN[new_id]:
+            # Move the last open tile into the freed slot
+            slot = self.open_slots.pop(index)
+            last = self.open.pop()
+            if last != index:
+                self.open[slot] = last
+                self.open_slots[last] = slot
+        elif TILE_OPEN[new_id] and not TILE_OPEN[old_id]:
+            self.open_slots[index] = len(self.open)
+            self.open.append(index)
+
+    def random_open(self, rng, taken=()):
+        # A random open (x, y) not among the positions in taken, or None if
+        # there is none. One draw whatever the map looks like: landing on a
+        # taken tile takes the next free slot.
+        count = len(self.open)
+        start = rng.randrange(count) if count else 0
+        for offset in range(count):
+            index = self.open[(start + offset) % count]
+            position = (index % self.width, index // self.width)
+            if position not in taken:
+                return position
+        return None
+
+
+# Per-biome tile ID populations and cumulative weights for random.choices()
+BIOME_TILE_TABLES = {
+    biome: ([TILE_IDS[tile_type] for _, tile_type in thresholds], [threshold for threshold, _ in thresholds])
+    for biome, thresholds in BIOME_TILE_THRESHOLDS.items()
+}
+
+
+def generate_biome_tiles(biome, width, height, rng=random):
+    # A width x height TileMap of biome terrain, drawn in one batch. choices()
+    # bisects one random() draw per tile against the cumulative thresholds, so
+    # the result is the same as picking tile by tile with the same generator.
+    tile_map = TileMap(width, height)
+    table = BIOME_TILE_TABLES.get(biome)
+    if table is not None:
+        tile_ids, cum_weights = table
+        tile_map.tiles[:] = bytes(rng.choices(tile_ids, cum_weights=cum_weights, k=width * height))
+    return tile_map
@@ -0,0 +1,138 @@
+# travel.py
+#
+# Route planning for the travel command, in two levels. A coarse route is
+# planned over world cells by biome. Each map edge has a portal, its passable
+# tile nearest the middle; a cell is crossed from the portal of the side the
+# player came in by to the portal facing the next cell on the route, then off
+# the edge. These portal-to-portal paths are cached by cell, sides and map
+# revision, so repeated trips through a region reuse them; only the short
+# walk from where the player arrives to the entry portal is searched anew.
+
+import heapq
+from collections import OrderedDict, deque
+from config import *
+
+# Tiles a route may cross; entrances are avoided, since stepping on one leaves the map
+ROUTE_AVOID_TILES = ['DUNGEON_ENTRANCE', 'BUILDING_ENTRANCE']
+TILE_PASSABLE = bytes(TILE_WALKABLE[tile_id] and TILE_TYPES[tile_id] not in ROUTE_AVOID_TILES
+                      for tile_id in range(len(TILE_TYPES)))
+
+
+def find_path(local_map, start, goals):
+    # Shortest path of (dx, dy) steps from start to the nearest of the goal
+    # indices, breadth-first over passable tiles; None if none can be reached
+    width = local_map.width
+    tiles = local_map.tiles
+    start_index = start[1] * width + start[0]
+    parents = {start_index: None}
+    frontier = deque([start_index])
+    while frontier:
+        index = frontier.popleft()
+        if index in goals:
+            steps = []
+            while parents[index] is not None:
+                parent = parents[index]
+                steps.append((index % width - parent % width, index // width - parent // width))
+                index = parent
+            steps.reverse()
+            return steps
+        x = index % width
+        for neighbor, inside in ((index - 1, x > 0), (index + 1, x < width - 1),
+                                 (index - width, index >= width), (index + width, index + width < len(tiles))):
+            if inside and neighbor not in parents and TILE_PASSABLE[tiles[neighbor]]:
+                parents[neighbor] = index
+                frontier.append(neighbor)
+    return None
+
+
+def portal(local_map, side):
+    # The passable tile on the map edge on side (dx, dy) nearest the middle
+    # of that edge, None if the edge is closed
+    dx, dy = side
+    if dx:
+        x = local_map.width - 1 if dx > 0 else 0
+        edge = [(x, y) for y in range(local_map.height)]
+    else:
+        y = local_map.height - 1 if dy > 0 else 0
+        edge = [(x, y) for x in range(local_map.width)]
+    middle = len(edge) // 2
+    for position in sorted(edge, key=lambda position: abs(position[0] + position[1] - edge[middle][0] - edge[middle][1])):
+        if TILE_PASSABLE[local_map.get(*position)]:
+            return position
+    return None
+
+
+class TravelPlanner:
+    def __init__(self, world_map):
+        self.world_map = world_map
+        self.paths = OrderedDict()  # Key: (kind, cell, start, goal, map revision), Value: steps or None
+
+    def plan_route(self, start, target, blocked=()):
+        # Cheapest chain of world cells from start to target, both included,
+        # by A* over TRAVEL_BIOME_COSTS; (from, to) cell pairs in blocked are
+        # not crossed. None if the target cannot be reached within
+        # TRAVEL_MAX_CELLS cells searched.
+        if self.cost(target) is None:
+            return None
+        came_from = {start: None}
+        costs = {start: 0}
+        queue = [(0, start)]
+        searched = 0
+        while queue and searched < TRAVEL_MAX_CELLS:
+            _, cell = heapq.heappop(queue)
+            if cell == target:
+                route = []
+                while cell is not None:
+                    route.append(cell)
+                    cell = came_from[cell]
+                route.reverse()
+                return route
+            searched += 1
+            for next_cell in ((cell[0] + 1, cell[1]), (cell[0] - 1, cell[1]), (cell[0], cell[1] + 1), (cell[0], cell[1] - 1)):
+                step_cost = self.cost(next_cell)
+                if step_cost is None or (cell, next_cell) in blocked:
+                    continue
+                cost = costs[cell] + step_cost
+                if cost < costs.get(next_cell, cost + 1):
+                    costs[next_cell] = cost
+                    came_from[next_cell] = cell
+                    estimate = abs(target[0] - next_cell[0]) + abs(target[1] - next_cell[1])
+                    heapq.heappush(queue, (cost + estimate, next_cell))
+        return None
+
+    def cost(self, cell):
+        # Cost of crossing a world cell, None for impassable ones
+        return TRAVEL_BIOME_COSTS.get(self.world_map.cell(*cell)['biome'])
+
+    def crossing_path(self, local_map, cell, start, entry_side, exit_side):
+        # Steps from start off the map through the portal of exit_side (dx, dy),
+        # ending with the step that crosses into the next cell. entry_side is
+        # the side the player came in by, None where the trip began; the
+        # player then goes by its portal. None if there is no way through.
+        exit_portal = portal(local_map, exit_side)
+        if exit_portal is None:
+            return None
+        if entry_side is not None:
+            entry_portal = portal(local_map, entry_side)
+            if entry_portal is not None:
+                to_entry = find_path(local_map, start, {entry_portal[1] * local_map.width + entry_portal[0]})
+                across = self.tile_path(local_map, cell, entry_portal, exit_portal)
+                if to_entry is not None and across is not None:
+                    return to_entry + across + [exit_side]
+        steps = self.tile_path(local_map, cell, start, exit_portal)
+        return None if steps is None else steps + [exit_side]
+
+    def tile_path(self, local_map, cell, start, goal):
+        # Steps from start to the goal position on the same map
+        def plan():
+            return find_path(local_map, start, {goal[1] * local_map.width + goal[0]})
+        return self.cached(('tile', cell, start, goal, local_map.revision), plan)
+
+    def cached(self, key, plan):
+        if key in self.paths:
+            self.paths.move_to_end(key)
+            return self.paths[key]
+        steps = self.paths[key] = plan()
+        if len(self.paths) > TRAVEL_PATH_CACHE_SIZE:
+            self.paths.popitem(last=False)
+        return steps
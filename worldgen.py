@@ -0,0 +1,265 @@
+# worldgen.py
+#
+# World, local map and dungeon generation. Everything here is a pure function
+# of the world seed and the coordinates being built: each map gets its own
+# random.Random seeded from them, so a map can be dropped and rebuilt exactly,
+# and only the changes made to it afterwards need to be kept.
+
+import random
+from config import *
+from tilemap import TileMap, generate_biome_tiles
+
+
+def seeded_rng(world_seed, *key):
+    # String seeds are hashed with SHA-512, so they are stable across runs
+    return random.Random('/'.join(str(part) for part in (world_seed,) + key))
+
+
+def cell_rng(world_seed, cell_x, cell_y, stream='map'):
+    return seeded_rng(world_seed, 'cell', cell_x, cell_y, stream)
+
+
+def dungeon_rng(world_seed, cell, entrance, level, stream='map'):
+    return seeded_rng(world_seed, 'dungeon', cell[0], cell[1], entrance[0], entrance[1], level, stream)
+
+
+def generate_world_chunk(world_seed, chunk_x, chunk_y):
+    # Rows of world cells for one WORLD_CHUNK_CELLS x WORLD_CHUNK_CELLS chunk.
+    # Features are as dense as on the old 40x30 world, but each chunk only
+    # depends on its own seed, so chunks can be generated in any order.
+    rng = seeded_rng(world_seed, 'chunk', chunk_x, chunk_y)
+    size = WORLD_CHUNK_CELLS
+    chunk = [[{'biome': 'PLAIN', 'town': False, 'dungeons': [], 'name': None} for _ in range(size)] for _ in range(size)]
+
+    # Scatter blobs of other biomes
+    num_blobs = round(60 * size * size / (40 * 30))
+    for _ in range(num_blobs):
+        biome = rng.choice(['FOREST', 'MOUNTAIN', 'DESERT', 'WATER'])
+        blob_size = rng.randint(2, 5)
+        blob_x = rng.randint(0, size - 1)
+        blob_y = rng.randint(0, size - 1)
+        create_biome_blob(chunk, blob_x, blob_y, blob_size, biome, rng)
+
+    # Place towns/villages
+    num_towns = round(20 * size * size / (40 * 30))
+    for _ in range(num_towns):
+        town_x = rng.randint(0, size - 1)
+        town_y = rng.randint(0, size - 1)
+        chunk[town_y][town_x]['town'] = True
+
+    # Place dungeons
+    for y in range(size):
+        for x in range(size):
+            if rng.random() < 0.5:
+                num_dungeons = rng.randint(1, 3)
+                dungeon_positions = []
+                for _ in range(num_dungeons):
+                    dungeon_positions.append(random_dungeon_position(rng))
+                chunk[y][x]['dungeons'] = dungeon_positions
+
+    return chunk
+
+
+def random_dungeon_position(rng):
+    # Return a random position within the local map bounds
+    x = rng.randint(5, LOCAL_MAP_WIDTH - 6)  # Avoid edges
+    y = rng.randint(5, LOCAL_MAP_HEIGHT - 6)
+    return (x, y)
+
+
+def create_biome_blob(chunk, x, y, size, biome, rng):
+    # Blobs are clipped to their own chunk
+    cells_to_fill = [(x, y)]
+    for _ in range(size):
+        if cells_to_fill:
+            cx, cy = cells_to_fill.pop(0)
+            if 0 <= cx < WORLD_CHUNK_CELLS and 0 <= cy < WORLD_CHUNK_CELLS:
+                chunk[cy][cx]['biome'] = biome
+                # Add neighboring cells
+                neighbors = [
+                    (cx + 1, cy), (cx - 1, cy),
+                    (cx, cy + 1), (cx, cy - 1)
+                ]
+                rng.shuffle(neighbors)
+                cells_to_fill.extend(neighbors[:2])
+
+
+class WorldMap:
+    # The world, without bounds, as chunks of world cells generated the first
+    # time they are looked at. Chunks further than WORLD_CHUNK_RADIUS from the
+    # last center passed to keep_around() are unloaded; they are regenerated
+    # identically from the seed if they are needed again.
+    def __init__(self, world_seed):
+        self.world_seed = world_seed
+        self.chunks = {}  # Key: (chunk_x, chunk_y)
+
+    def cell(self, cell_x, cell_y):
+        chunk_key = (cell_x // WORLD_CHUNK_CELLS, cell_y // WORLD_CHUNK_CELLS)
+        chunk = self.chunks.get(chunk_key)
+        if chunk is None:
+            chunk = generate_world_chunk(self.world_seed, *chunk_key)
+            self.chunks[chunk_key] = chunk
+        return chunk[cell_y % WORLD_CHUNK_CELLS][cell_x % WORLD_CHUNK_CELLS]
+
+    def keep_around(self, cell):
+        center_x, center_y = cell[0] // WORLD_CHUNK_CELLS, cell[1] // WORLD_CHUNK_CELLS
+        for chunk_x, chunk_y in list(self.chunks):
+            if max(abs(chunk_x - center_x), abs(chunk_y - center_y)) > WORLD_CHUNK_RADIUS:
+                del self.chunks[(chunk_x, chunk_y)]
+
+
+def generate_cell_map(world_seed, cell_x, cell_y, cell_data):
+    # The local map of a world cell as it was first generated
+    rng = cell_rng(world_seed, cell_x, cell_y)
+    local_map = generate_biome_tiles(cell_data['biome'], LOCAL_MAP_WIDTH, LOCAL_MAP_HEIGHT, rng)
+
+    # Optionally, add features based on whether the cell contains a town
+    if cell_data['town']:
+        place_town(local_map, rng)
+
+    # Place dungeon entrances if any
+    for x, y in cell_data.get('dungeons', []):
+        local_map.set(x, y, TILE_IDS['DUNGEON_ENTRANCE'])
+    return local_map
+
+
+def place_town(local_map, rng):
+    # Place a town in the local map
+    town_center_x = LOCAL_MAP_WIDTH // 2
+    town_center_y = LOCAL_MAP_HEIGHT // 2
+    town_size = 20  # Adjust the size of the town
+    num_buildings = 5  # Number of buildings
+    building_size = 6  # Size of each building
+
+    # Clear the town area to plains
+    local_map.fill_rect(town_center_x - town_size // 2, town_center_y - town_size // 2, town_size, town_size, TILE_IDS['PLAIN'])
+
+    # Place buildings
+    for i in range(num_buildings):
+        # Randomly position buildings within the town area
+        b_x = rng.randint(town_center_x - town_size // 2, town_center_x + town_size // 2 - building_size)
+        b_y = rng.randint(town_center_y - town_size // 2, town_center_y + town_size // 2 - building_size)
+        # Build building: walls on the edges, floor inside
+        local_map.fill_rect(b_x, b_y, building_size, building_size, TILE_IDS['HOUSE_WALL'])
+        local_map.fill_rect(b_x + 1, b_y + 1, building_size - 2, building_size - 2, TILE_IDS['HOUSE_FLOOR'])
+        # Place door
+        door_side = rng.choice(['top', 'bottom', 'left', 'right'])
+        if door_side == 'top':
+            door_x = rng.randint(b_x + 1, b_x + building_size - 2)
+            door_y = b_y
+        elif door_side == 'bottom':
+            door_x = rng.randint(b_x + 1, b_x + building_size - 2)
+            door_y = b_y + building_size -1
+        elif door_side == 'left':
+            door_x = b_x
+            door_y = rng.randint(b_y + 1, b_y + building_size - 2)
+        elif door_side == 'right':
+            door_x = b_x + building_size -1
+            door_y = rng.randint(b_y + 1, b_y + building_size - 2)
+        local_map.set(door_x, door_y, TILE_IDS['DOOR'])
+
+
+def dungeon_depth(world_seed, cell, entrance):
+    # Number of levels of the dungeon behind an entrance
+    return seeded_rng(world_seed, 'dungeon', cell[0], cell[1], entrance[0], entrance[1], 'depth').randint(2, 5)
+
+
+def generate_dungeon_level(world_seed, cell, entrance, level, max_level):
+    # Returns (dungeon_map, arrival), arrival being the entrance or stairs up
+    # the player starts on when coming to this level
+    rng = dungeon_rng(world_seed, cell, entrance, level)
+    dungeon_map, rooms = create_dungeon_map(rng)
+
+    # Place stairs if not last level
+    if level < max_level:
+        place_feature_in_random_room(dungeon_map, rooms, 'STAIRS_DOWN', rng)
+        # Optionally, place stairs up if needed
+        if level > 1:
+            place_feature_in_random_room(dungeon_map, rooms, 'STAIRS_UP', rng)
+
+    if level > 1:
+        # Place stairs up on levels beyond the first
+        arrival = place_feature_in_random_room(dungeon_map, rooms, 'STAIRS_UP', rng)
+    else:
+        arrival = place_feature_in_random_room(dungeon_map, rooms, 'ENTRANCE', rng)
+    return dungeon_map, arrival
+
+
+def create_dungeon_map(rng):
+    dungeon_map = TileMap(LOCAL_MAP_WIDTH, LOCAL_MAP_HEIGHT, 'WALL')
+    rooms = []  # Keep track of rooms
+    max_rooms = 10
+    room_min_size = 6
+    room_max_size = 12
+
+    for _ in range(max_rooms):
+        w = rng.randint(room_min_size, room_max_size)
+        h = rng.randint(room_min_size, room_max_size)
+        x = rng.randint(1, LOCAL_MAP_WIDTH - w - 1)
+        y = rng.randint(1, LOCAL_MAP_HEIGHT - h - 1)
+        new_room = Rect(x, y, w, h)
+
+        # Check for overlaps
+        failed = False
+        for other_room in rooms:
+            if new_room.intersect(other_room):
+                failed = True
+                break
+        if not failed:
+            # Create room
+            create_room(dungeon_map, new_room)
+            rooms.append(new_room)
+
+            # Connect to previous room
+            if len(rooms) > 1:
+                prev_room = rooms[-2]
+                connect_rooms(dungeon_map, prev_room, new_room, rng)
+    place_chests(dungeon_map, rooms, rng)
+
+    return dungeon_map, rooms
+
+
+def place_chests(dungeon_map, rooms, rng):
+    num_chests = rng.randint(1, len(rooms) // 2)  # Up to half the rooms
+    chest_rooms = rng.sample(rooms, num_chests)
+    for room in chest_rooms:
+        x = rng.randint(room.x1 + 1, room.x2 - 1)
+        y = rng.randint(room.y1 + 1, room.y2 - 1)
+        if dungeon_map.get(x, y) == TILE_IDS['FLOOR']:
+            dungeon_map.set(x, y, TILE_IDS['CHEST'])
+
+
+def create_room(dungeon_map, room):
+    dungeon_map.fill_rect(room.x1 + 1, room.y1 + 1, room.x2 - room.x1 - 1, room.y2 - room.y1 - 1, TILE_IDS['FLOOR'])
+
+
+def create_h_tunnel(dungeon_map, x1, x2, y):
+    dungeon_map.fill_rect(min(x1, x2), y, abs(x2 - x1) + 1, 1, TILE_IDS['FLOOR'])
+
+
+def create_v_tunnel(dungeon_map, y1, y2, x):
+    dungeon_map.fill_rect(x, min(y1, y2), 1, abs(y2 - y1) + 1, TILE_IDS['FLOOR'])
+
+
+def connect_rooms(dungeon_map, room1, room2, rng):
+    # Get the center coordinates of both rooms
+    x1, y1 = room1.center_x(), room1.center_y()
+    x2, y2 = room2.center_x(), room2.center_y()
+
+    # Randomly decide whether to go horizontal first or vertical
+    if rng.choice([True, False]):
+        # Horizontal then vertical
+        create_h_tunnel(dungeon_map, x1, x2, y1)
+        create_v_tunnel(dungeon_map, y1, y2, x2)
+    else:
+        # Vertical then horizontal
+        create_v_tunnel(dungeon_map, y1, y2, x1)
+        create_h_tunnel(dungeon_map, x1, x2, y2)
+
+
+def place_feature_in_random_room(dungeon_map, rooms, feature, rng):
+    room = rng.choice(rooms)
+    x = rng.randint(room.x1 + 1, room.x2 - 1)
+    y = rng.randint(room.y1 + 1, room.y2 - 1)
+    dungeon_map.set(x, y, TILE_IDS[feature])
+    return x, y